@@ -5,7 +5,18 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    from app import metrics
+    metrics.init_app(app)
+
     from app.routes import main_bp
     app.register_blueprint(main_bp)
 
+    from app.commands import (
+        build_stats_command, ingest_command, publish_command, seed_tiles_command,
+    )
+    app.cli.add_command(build_stats_command)
+    app.cli.add_command(ingest_command)
+    app.cli.add_command(publish_command)
+    app.cli.add_command(seed_tiles_command)
+
     return app
\ No newline at end of file
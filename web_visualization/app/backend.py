@@ -0,0 +1,164 @@
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import numpy as np
+import xarray as xr
+
+from app.store import open_store, store_version
+
+# Variables the API serves and how they are derived from the data store:
+# the selection that reduces them to (time, lat, lon) and the offset applied
+# (Kelvin -> Celsius for TMP)
+SERVING_VARIABLES = {
+    'TMP': {'select': {'height': 2.0}, 'offset': -273.15, 'units': 'degC'},
+}
+
+CURRENT_FILE = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+COORDS = ('time', 'lat', 'lon')
+
+
+def serving_variable(ds, name):
+    # Lazily indexed (time, lat, lon) view in the stored units. The offset is
+    # only recorded in attrs: arithmetic on the lazy NetCDF array would decode
+    # the whole variable, so in_serving_units applies it after indexing.
+    spec = SERVING_VARIABLES[name]
+    return ds[name].sel(spec['select']).transpose(*COORDS).assign_attrs(offset=spec['offset'])
+
+
+def in_serving_units(data):
+    # Apply the unit offset to an already indexed serving variable. This reads
+    # the selected cells; variables without an offset (the published memory
+    # maps are stored converted) pass through untouched.
+    offset = data.attrs.get('offset')
+    if not offset:
+        return data
+    converted = data + offset
+    converted.attrs = {k: v for k, v in data.attrs.items() if k != 'offset'}
+    return converted
+
+
+class NetCDFBackend:
+    # Serves straight from the NetCDF store, decoding lazily in each process.
+    # version identifies what is served; source_version the store it came
+    # from, which is the same thing here. Only used while nothing has been
+    # published to backend_dir: the first publish retires it, so every
+    # worker moves over to the memory maps without a restart.
+
+    def __init__(self, path, backend_dir=None):
+        self.path = path
+        self.backend_dir = backend_dir
+        self.version = store_version(path)
+        self.source_version = self.version
+        self.dataset = open_store(path)
+        self.variables = {name: serving_variable(self.dataset, name) for name in SERVING_VARIABLES}
+
+    def is_current(self):
+        if self.backend_dir and read_current(self.backend_dir):
+            return False
+        try:
+            return store_version(self.path) == self.version
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        self.dataset.close()
+
+
+class MappedBackend:
+    # Serves read-only memory maps of the published .npy files. Every worker
+    # maps the same files, so the decoded arrays live once in the page cache
+    # instead of once per process, and opening them costs next to nothing.
+    # version names the publish; source_version the store it was exported
+    # from, so republishing the same data keeps the same source_version.
+
+    def __init__(self, root):
+        self.root = root
+        self.version = read_current(root)
+        version_dir = os.path.join(root, self.version)
+        with open(os.path.join(version_dir, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.source_version = self.manifest['source_version']
+
+        coords = {name: np.load(os.path.join(version_dir, f'{name}.npy')) for name in COORDS}
+        self.variables = {}
+        for name, info in self.manifest['variables'].items():
+            data = np.load(os.path.join(version_dir, f'{name}.npy'), mmap_mode='r')
+            self.variables[name] = xr.DataArray(
+                data, dims=COORDS, coords=coords, name=name, attrs={'units': info['units']})
+
+    def is_current(self):
+        return read_current(self.root) == self.version
+
+    def close(self):
+        self.variables = {}
+
+
+def read_current(root):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def open_backend(data_path, backend_dir):
+    # Prefer the published memory maps and fall back to the NetCDF store
+    if backend_dir and read_current(backend_dir):
+        return MappedBackend(backend_dir)
+    return NetCDFBackend(data_path, backend_dir)
+
+
+def publish(data_path, backend_dir, keep=2, log=print):
+    # Export the serving variables of the NetCDF store as .npy files in a new
+    # version directory, then point CURRENT at it with an atomic rename.
+    # Workers pick the new version up on their next request.
+    version = datetime.now(timezone.utc).strftime('v%Y%m%dT%H%M%S%f')
+    staging = os.path.join(backend_dir, f'.{version}.tmp')
+    os.makedirs(staging)
+    try:
+        with open_store(data_path) as ds:
+            manifest = {
+                'version': version,
+                'source': os.path.abspath(data_path),
+                'source_version': store_version(data_path),
+                'variables': {},
+            }
+            for name in COORDS:
+                np.save(os.path.join(staging, f'{name}.npy'), ds[name].values)
+            for name in SERVING_VARIABLES:
+                field = serving_variable(ds, name)
+                out = np.lib.format.open_memmap(
+                    os.path.join(staging, f'{name}.npy'), mode='w+',
+                    dtype=np.float32, shape=field.shape)
+                # One timestep at a time keeps memory flat however long the record is
+                for i in range(field.sizes['time']):
+                    out[i] = in_serving_units(field.isel(time=i)).values
+                out.flush()
+                del out
+                manifest['variables'][name] = {
+                    'units': SERVING_VARIABLES[name]['units'],
+                    'shape': list(field.shape),
+                }
+                log(f"{name}: {field.shape}")
+        with open(os.path.join(staging, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, os.path.join(backend_dir, version))
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer = os.path.join(backend_dir, f'.{CURRENT_FILE}.tmp')
+    with open(pointer, 'w') as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(backend_dir, CURRENT_FILE))
+
+    # Old versions can go once they are out of the rotation; processes still
+    # mapping them keep their pages until they remap
+    versions = sorted(d for d in os.listdir(backend_dir)
+                      if d.startswith('v') and os.path.isdir(os.path.join(backend_dir, d)))
+    for old in versions[:-keep]:
+        shutil.rmtree(os.path.join(backend_dir, old), ignore_errors=True)
+    return version
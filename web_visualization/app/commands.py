@@ -0,0 +1,86 @@
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from app.backend import publish
+from app.ingest import DEFAULT_CHUNKS, ingest
+from app.stats import build_stats
+
+
+@click.command('seed-tiles')
+@click.option('--var', default='TMP', show_default=True, help='Variable to render.')
+@click.option('--max-zoom', default=6, show_default=True, help='Highest zoom level to pre-render.')
+@with_appcontext
+def seed_tiles_command(var, max_zoom):
+    """Pre-render the low zoom levels of the tile pyramid for every timestep."""
+    from app.routes import get_backend, get_tile_service
+    from app.tiles import TILE_VARIABLES
+
+    if var not in TILE_VARIABLES:
+        raise click.BadParameter(f"no tile style for {var}", param_hint='--var')
+
+    backend = get_backend()
+    started = time.perf_counter()
+
+    def progress(timestep, count):
+        click.echo(f"{str(timestep)[:19]}: {count} tiles")
+
+    count = get_tile_service().seed(backend.variables[var], backend.version, var, max_zoom,
+                                    progress=progress)
+    click.echo(f"Seeded {count} tiles in {time.perf_counter() - started:.1f}s")
+
+
+@click.command('ingest')
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--workers', type=int, default=None, help='Reader processes (default: CPU count).')
+@click.option('--chunks', default=','.join(map(str, DEFAULT_CHUNKS)), show_default=True,
+              help='Chunk sizes as time,level,lat,lon.')
+@click.option('--complevel', default=4, show_default=True, help='zlib compression level.')
+@click.option('--rebuild', is_flag=True, help='Rewrite the store from scratch instead of appending.')
+@click.option('--publish', 'publish_after', is_flag=True,
+              help='Publish the shared memory-mapped arrays once new data is written.')
+@with_appcontext
+def ingest_command(paths, workers, chunks, complevel, rebuild, publish_after):
+    """Append raw NLDAS daily files (or directories of them) to the data store."""
+    try:
+        chunk_sizes = tuple(int(c) for c in chunks.split(','))
+    except ValueError:
+        chunk_sizes = ()
+    if len(chunk_sizes) != 4:
+        raise click.BadParameter("expected four comma-separated integers", param_hint='--chunks')
+
+    store_path = current_app.config['DATA_PATH']
+    started = time.perf_counter()
+    count = ingest(paths, store_path, workers=workers, chunks=chunk_sizes,
+                   complevel=complevel, rebuild=rebuild, log=click.echo)
+    click.echo(f"Wrote {count} timestep(s) to {store_path} in {time.perf_counter() - started:.1f}s")
+    if count and publish_after:
+        _publish()
+
+
+def _publish():
+    version = publish(current_app.config['DATA_PATH'], current_app.config['BACKEND_DIR'],
+                      log=click.echo)
+    click.echo(f"Published {version} to {current_app.config['BACKEND_DIR']}")
+
+
+@click.command('publish')
+@with_appcontext
+def publish_command():
+    """Export the serving variables as memory-mapped arrays shared by all workers."""
+    _publish()
+
+
+@click.command('build-stats')
+@with_appcontext
+def build_stats_command():
+    """Precompute the statistics sidecar served by /api/stats."""
+    from app.routes import get_backend
+
+    backend = get_backend()
+    started = time.perf_counter()
+    build_stats(backend.variables['TMP'], backend.source_version, current_app.config['STATS_PATH'],
+                log=click.echo)
+    click.echo(f"Wrote {current_app.config['STATS_PATH']} in {time.perf_counter() - started:.1f}s")
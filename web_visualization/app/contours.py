@@ -0,0 +1,235 @@
+import numpy as np
+
+from app.backend import in_serving_units
+
+# Default isotherms, matching the colour breaks of the map legend (deg C)
+DEFAULT_LEVELS = (0.0, 5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 35.0, 40.0)
+MAX_LEVELS = 50
+
+# Contour segments are computed and cached per tile of TILE_CELLS x TILE_CELLS
+# grid cells, so overlapping bboxes reuse each other's work; segments of all
+# tiles are joined into lines per request
+TILE_CELLS = 64
+
+# Cell edges, numbered 0 = bottom (i, j)-(i, j+1), 1 = right (i, j+1)-(i+1, j+1),
+# 2 = top (i+1, j)-(i+1, j+1), 3 = left (i, j)-(i+1, j).
+# Marching-squares case = bottom-left + 2 * bottom-right + 4 * top-right
+# + 8 * top-left, each bit set when that corner is above the level.
+# Saddles (5, 10) have two entries, picked by the mean of the four corners.
+SEGMENTS = {
+    1: [(3, 0)], 2: [(0, 1)], 3: [(3, 1)], 4: [(1, 2)],
+    6: [(0, 2)], 7: [(3, 2)], 8: [(2, 3)], 9: [(0, 2)],
+    11: [(1, 2)], 12: [(1, 3)], 13: [(0, 1)], 14: [(3, 0)],
+}
+SADDLES = {
+    # case: (segments when the centre is above the level, when it is below)
+    5: ([(0, 1), (2, 3)], [(3, 0), (1, 2)]),
+    10: ([(3, 0), (1, 2)], [(0, 1), (2, 3)]),
+}
+
+
+def _edge_points(field, lats, lons, level, rows, cols, edge, origin, grid_shape):
+    # Interpolated crossing on one edge of the cells at (rows, cols), plus an
+    # id for that edge that is unique over the whole grid, so segments can be
+    # joined up afterwards even when they come from different tiles
+    ny, nx = grid_shape
+    row0, col0 = origin
+    if edge in (0, 2):
+        i = rows + (edge == 2)
+        a, b = field[i, cols], field[i, cols + 1]
+        t = (level - a) / (b - a)
+        points = np.column_stack([lons[cols] + t * (lons[cols + 1] - lons[cols]), lats[i]])
+        ids = (i + row0) * nx + cols + col0
+    else:
+        j = cols + (edge == 1)
+        a, b = field[rows, j], field[rows + 1, j]
+        t = (level - a) / (b - a)
+        points = np.column_stack([lons[j], lats[rows] + t * (lats[rows + 1] - lats[rows])])
+        ids = ny * nx + (rows + row0) * nx + j + col0
+    return points, ids
+
+
+def marching_squares(field, lats, lons, level, origin=(0, 0), grid_shape=None):
+    # All contour segments of field at level, as (start, end) point pairs, the
+    # matching edge ids and the (row, col) of the cell each one crosses. field
+    # may be a window of a larger grid: origin is the grid index of its first
+    # point and grid_shape the shape of the grid, so ids and cells are
+    # grid-wide. Cells touching a missing value are skipped.
+    grid_shape = grid_shape or field.shape
+    bl, br = field[:-1, :-1], field[:-1, 1:]
+    tl, tr = field[1:, :-1], field[1:, 1:]
+    case = ((bl > level) * 1 + (br > level) * 2 + (tr > level) * 4 + (tl > level) * 8)
+    case[np.isnan(bl) | np.isnan(br) | np.isnan(tl) | np.isnan(tr)] = 0
+    centre_high = (bl + br + tl + tr) / 4 > level
+
+    starts, ends, start_ids, end_ids, cells = [], [], [], [], []
+
+    def add(rows, cols, pairs):
+        for a, b in pairs:
+            pa, ia = _edge_points(field, lats, lons, level, rows, cols, a, origin, grid_shape)
+            pb, ib = _edge_points(field, lats, lons, level, rows, cols, b, origin, grid_shape)
+            starts.append(pa)
+            ends.append(pb)
+            start_ids.append(ia)
+            end_ids.append(ib)
+            cells.append(np.column_stack([rows + origin[0], cols + origin[1]]))
+
+    for c, pairs in SEGMENTS.items():
+        rows, cols = np.nonzero(case == c)
+        if len(rows):
+            add(rows, cols, pairs)
+    for c, (high_pairs, low_pairs) in SADDLES.items():
+        for high, pairs in ((True, high_pairs), (False, low_pairs)):
+            rows, cols = np.nonzero((case == c) & (centre_high == high))
+            if len(rows):
+                add(rows, cols, pairs)
+
+    if not starts:
+        return (np.empty((0, 2)), np.empty((0, 2)), np.empty(0, int), np.empty(0, int),
+                np.empty((0, 2), int))
+    return (np.concatenate(starts), np.concatenate(ends),
+            np.concatenate(start_ids), np.concatenate(end_ids), np.concatenate(cells))
+
+
+def stitch(starts, ends, start_ids, end_ids):
+    # Join segments that share an edge crossing into polylines. Every crossing
+    # belongs to at most two segments, so each one is walked once.
+    neighbours = {}
+    for k, (a, b) in enumerate(zip(start_ids.tolist(), end_ids.tolist())):
+        neighbours.setdefault(a, []).append(k)
+        neighbours.setdefault(b, []).append(k)
+    points = {}
+    for k, (a, b) in enumerate(zip(start_ids.tolist(), end_ids.tolist())):
+        points[a] = starts[k]
+        points[b] = ends[k]
+
+    used = np.zeros(len(start_ids), dtype=bool)
+    segment_ends = np.column_stack([start_ids, end_ids]).tolist()
+
+    def walk(node, segment):
+        chain = []
+        while segment is not None:
+            used[segment] = True
+            a, b = segment_ends[segment]
+            node = b if node == a else a
+            chain.append(node)
+            segment = next((s for s in neighbours[node] if not used[s]), None)
+        return chain
+
+    lines = []
+    # Start from open ends first so open lines come out in one piece
+    order = sorted(neighbours, key=lambda node: len(neighbours[node]))
+    for node in order:
+        for segment in neighbours[node]:
+            if used[segment]:
+                continue
+            forward = walk(node, segment)
+            lines.append(np.array([points[n] for n in [node] + forward]))
+    return lines
+
+
+def simplify(line, tolerance):
+    # Douglas-Peucker with an explicit stack
+    if tolerance <= 0 or len(line) < 3:
+        return line
+    keep = np.zeros(len(line), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(line) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start, end = line[first], line[last]
+        inner = line[first + 1:last]
+        direction = end - start
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(*(inner - start).T)
+        else:
+            distances = np.abs(direction[0] * (inner[:, 1] - start[1])
+                               - direction[1] * (inner[:, 0] - start[0])) / length
+        k = int(np.argmax(distances))
+        if distances[k] > tolerance:
+            keep[first + 1 + k] = True
+            stack.append((first, first + 1 + k))
+            stack.append((first + 1 + k, last))
+    return line[keep]
+
+
+def contour_lines(field, lats, lons, levels, tolerance=0.0):
+    # {level: [polyline, ...]} with each polyline an (n, 2) array of lon, lat
+    result = {}
+    for level in levels:
+        lines = stitch(*marching_squares(field, lats, lons, level)[:4])
+        result[level] = [simplify(line, tolerance) for line in lines]
+    return result
+
+
+def tile_slices(n, start, stop):
+    # Index slices of the tiles (along one axis) that cover indices [start, stop).
+    # Each tile reaches one point into the next so no cell falls between tiles.
+    first = start // TILE_CELLS
+    last = max(stop - 1, start) // TILE_CELLS
+    return [(t, slice(t * TILE_CELLS, min((t + 1) * TILE_CELLS + 1, n)))
+            for t in range(first, last + 1)]
+
+
+def window_contours(data, time, bbox, levels, tolerance, cache, version):
+    # Contours of the (time, lat, lon) serving variable at one timestep over
+    # bbox. The segments of each tile covering bbox are looked up in cache
+    # first, and the field is only read when a tile has to be computed. The
+    # segments are then cropped to the cells inside bbox and joined into
+    # lines across tile seams on their grid-wide edge ids.
+    min_lat, max_lat, min_lon, max_lon = bbox
+    lats, lons = data['lat'].values, data['lon'].values
+    y0, y1 = np.searchsorted(lats, min_lat, 'left'), np.searchsorted(lats, max_lat, 'right')
+    x0, x1 = np.searchsorted(lons, min_lon, 'left'), np.searchsorted(lons, max_lon, 'right')
+    merged = {level: [] for level in levels}
+    if y1 - y0 < 2 or x1 - x0 < 2:
+        return merged
+
+    grid_shape = (len(lats), len(lons))
+    field = None
+    parts = {level: [] for level in levels}
+    for ty, rows in tile_slices(len(lats), y0, y1):
+        for tx, cols in tile_slices(len(lons), x0, x1):
+            key = (version, str(np.datetime64(time, 's')), levels, ty, tx)
+            entry = cache.get(key)
+            if entry is None:
+                if field is None:
+                    field = np.asarray(in_serving_units(data.sel(time=time)).transpose('lat', 'lon').values,
+                                       dtype=np.float64)
+                segments = {
+                    level: marching_squares(field[rows, cols], lats[rows], lons[cols], level,
+                                            origin=(rows.start, cols.start), grid_shape=grid_shape)
+                    for level in levels
+                }
+                entry = (segments, sum(a.nbytes for tile in segments.values() for a in tile))
+                cache.put(key, entry)
+            for level, tile_segments in entry[0].items():
+                parts[level].append(tile_segments)
+
+    for level, level_parts in parts.items():
+        starts, ends, start_ids, end_ids, cells = (np.concatenate(a) for a in zip(*level_parts))
+        # Only cells whose four corners lie inside bbox
+        inside = ((cells[:, 0] >= y0) & (cells[:, 0] < y1 - 1)
+                  & (cells[:, 1] >= x0) & (cells[:, 1] < x1 - 1))
+        lines = stitch(starts[inside], ends[inside], start_ids[inside], end_ids[inside])
+        merged[level] = [simplify(line, tolerance) for line in lines]
+    return merged
+
+
+def to_geojson(lines_by_level, precision=4):
+    features = []
+    for level, lines in lines_by_level.items():
+        if not lines:
+            continue
+        features.append({
+            'type': 'Feature',
+            'properties': {'level': level},
+            'geometry': {
+                'type': 'MultiLineString',
+                'coordinates': [np.round(line, precision).tolist() for line in lines],
+            },
+        })
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,103 @@
+import numpy as np
+
+from app.backend import in_serving_units
+
+TIME_REDUCTIONS = ('mean', 'min', 'max')
+STATISTICS = ('mean', 'min', 'max', 'count')
+
+# Timesteps read per pass when collapsing the time axis (a day of hourly data)
+TIME_CHUNK = 24
+
+
+def _reduce_time(temp_data, how):
+    # Collapse the time axis per grid point, leaving NaN where a point never
+    # has data. The window is read TIME_CHUNK timesteps at a time and folded
+    # into running totals, so memory is bounded by one chunk however many
+    # days are requested.
+    combine = {'mean': np.add, 'min': np.fmin, 'max': np.fmax}[how]
+    reduced = count = None
+    for start in range(0, temp_data.sizes['time'], TIME_CHUNK):
+        chunk = in_serving_units(temp_data.isel(time=slice(start, start + TIME_CHUNK)))
+        values = np.asarray(chunk.values)
+        valid = ~np.isnan(values)
+        if how == 'mean':
+            part = np.where(valid, values, 0).sum(axis=0, dtype=np.float64)
+        else:
+            part = combine.reduce(values, axis=0)
+        if reduced is None:
+            reduced, count = part, valid.sum(axis=0)
+        else:
+            reduced = combine(reduced, part)
+            count += valid.sum(axis=0)
+    if how == 'mean':
+        reduced = reduced / np.maximum(count, 1)
+    return np.where(count > 0, reduced, np.nan)
+
+
+def _block_starts(coords, cell_size):
+    # Cells are anchored to multiples of cell_size so they stay put as the bbox moves
+    ids = np.floor(np.round(coords / cell_size, 9)).astype(np.int64)
+    starts = np.flatnonzero(np.diff(ids, prepend=ids[0] - 1))
+    return starts, ids[starts] * cell_size
+
+
+def _reduceat(ufunc, array, lat_starts, lon_starts):
+    return ufunc.reduceat(ufunc.reduceat(array, lat_starts, axis=0), lon_starts, axis=1)
+
+
+def aggregate_grid(temp_data, cell_size, time_reduce='mean', statistics=STATISTICS):
+    # Coarsen a (time, lat, lon) serving variable window, still lazily indexed,
+    # into cell_size x cell_size cells. The time axis is reduced first, then
+    # every statistic is computed with a single reduceat pass per axis over the
+    # contiguous blocks of grid points.
+    temp_data = temp_data.transpose('time', 'lat', 'lon')
+    lats = temp_data['lat'].values
+    lons = temp_data['lon'].values
+    result = {'lat': np.array([]), 'lon': np.array([])}
+    if temp_data.sizes['time'] == 0 or len(lats) == 0 or len(lons) == 0:
+        result.update({name: np.empty((0, 0)) for name in statistics})
+        return result
+
+    field = _reduce_time(temp_data, time_reduce)
+    valid = ~np.isnan(field)
+    lat_starts, result['lat'] = _block_starts(lats, cell_size)
+    lon_starts, result['lon'] = _block_starts(lons, cell_size)
+
+    count = _reduceat(np.add, valid.astype(np.int32), lat_starts, lon_starts)
+    empty = count == 0
+    for name in statistics:
+        if name == 'count':
+            result[name] = count
+        elif name == 'mean':
+            total = _reduceat(np.add, np.where(valid, field, 0.0), lat_starts, lon_starts)
+            result[name] = np.where(empty, np.nan, total / np.maximum(count, 1))
+        elif name == 'min':
+            low = _reduceat(np.minimum, np.where(valid, field, np.inf), lat_starts, lon_starts)
+            result[name] = np.where(empty, np.nan, low)
+        else:
+            high = _reduceat(np.maximum, np.where(valid, field, -np.inf), lat_starts, lon_starts)
+            result[name] = np.where(empty, np.nan, high)
+    return result
+
+
+def encode_grid(result, cell_size, time_reduce):
+    # One flat row-major array per statistic; empty cells are null
+    payload = {
+        'cell_size': cell_size,
+        'time_reduce': time_reduce,
+        'lat': np.round(result['lat'], 4).tolist(),
+        'lon': np.round(result['lon'], 4).tolist(),
+        'shape': [len(result['lat']), len(result['lon'])],
+    }
+    for name in STATISTICS:
+        if name not in result:
+            continue
+        values = result[name]
+        if name == 'count':
+            payload[name] = values.ravel().tolist()
+            continue
+        rounded = np.round(values.ravel().astype(np.float64), 2)
+        cells = rounded.astype(object)
+        cells[np.isnan(rounded)] = None
+        payload[name] = cells.tolist()
+    return payload
@@ -0,0 +1,198 @@
+import glob
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from app.backend import SERVING_VARIABLES
+from app.store import read_segments, write_segments
+
+RAW_FILE_PATTERN = 'NLDAS_FORA0125_H.A*.nc4'
+
+# Default (time, level, lat, lon) chunking. The API reads a few days over a
+# bbox and the tile service a whole map per timestep, so chunks span several
+# timesteps over a moderate patch of the grid.
+DEFAULT_CHUNKS = (4, 1, 64, 64)
+
+TIME_UNITS = 'hours since 1970-01-01 00:00:00'
+FILL_VALUE = np.float32(1e20)
+
+_FILENAME_DATE = re.compile(r'\.A(\d{8})(?:\.(\d{4}))?\.')
+
+
+def file_timestamp(path):
+    # The time coordinate inside the GES DISC subsets is not the file's date,
+    # so the date is taken from the filename (…A20240531.002.grb.SUB.nc4)
+    match = _FILENAME_DATE.search(os.path.basename(path))
+    if match is None:
+        raise ValueError(f"Cannot parse a date from {path}")
+    day, hour = match.groups()
+    return pd.Timestamp(day + (hour or '0000'))
+
+
+def find_raw_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, RAW_FILE_PATTERN)))
+        else:
+            files.append(path)
+    return sorted(set(files), key=file_timestamp)
+
+
+def read_raw_file(path):
+    # Runs in a worker process: decode only the served variables and levels
+    stamp = file_timestamp(path)
+    with xr.open_dataset(path) as ds:
+        offsets = ds['time'].values - ds['time'].values[0]
+        times = (np.datetime64(stamp) + offsets).astype('datetime64[ns]')
+        # Only the served variables and levels are kept; everything else in
+        # the raw files is dropped
+        arrays = {
+            var: ds[var].sel(spec['select']).transpose('time', 'lat', 'lon').values.astype(np.float32)
+            for var, spec in SERVING_VARIABLES.items()
+        }
+        attrs = {var: dict(ds[var].attrs) for var in SERVING_VARIABLES}
+        return times, ds['lat'].values, ds['lon'].values, arrays, attrs
+
+
+def _create_store(path, lats, lons, attrs, chunks, complevel):
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('lat', len(lats))
+        nc.createDimension('lon', len(lons))
+
+        time = nc.createVariable('time', 'f8', ('time',))
+        time.units = TIME_UNITS
+        time.calendar = 'standard'
+        for name, values in (('lat', lats), ('lon', lons)):
+            coord = nc.createVariable(name, 'f8', (name,))
+            coord[:] = values
+
+        for var, spec in SERVING_VARIABLES.items():
+            # The served level is kept as a length-1 dimension, as in the raw files
+            (dim, level), = spec['select'].items()
+            if dim not in nc.dimensions:
+                nc.createDimension(dim, 1)
+                nc.createVariable(dim, 'f8', (dim,))[:] = [level]
+            t, _, y, x = chunks
+            data = nc.createVariable(
+                var, 'f4', ('time', dim, 'lat', 'lon'),
+                zlib=True, complevel=complevel, shuffle=True,
+                chunksizes=(t, 1, min(y, len(lats)), min(x, len(lons))),
+                fill_value=FILL_VALUE,
+            )
+            data.setncatts({k: v for k, v in attrs[var].items()
+                            if k not in ('_FillValue', 'missing_value')})
+
+
+def _stored_times(nc):
+    time = nc.variables['time']
+    if len(time) == 0:
+        return np.array([], dtype='datetime64[ns]')
+    return pd.to_datetime(netCDF4.num2date(
+        time[:], time.units, time.calendar,
+        only_use_cftime_datetimes=False, only_use_python_datetimes=True,
+    )).values
+
+
+def _segment_name(number, times):
+    first, last = pd.to_datetime(times[[0, -1]])
+    return f'{number:06d}-{first:%Y%m%d%H}-{last:%Y%m%d%H}.nc'
+
+
+def ingest(paths, store_path, workers=None, chunks=DEFAULT_CHUNKS, complevel=4,
+           rebuild=False, log=print):
+    # Append the raw files that are not yet in the store. Files are decoded in
+    # a process pool and written one at a time, so memory stays bounded by a
+    # few days of data however large the store grows.
+    #
+    # The store is a directory of time segments (see app.store). Each run
+    # writes its new days to one new segment file and then swaps in a
+    # manifest listing it, so an append costs only the new data and never
+    # touches a file the running app has open. Readers see the new segment
+    # when they next check the store version; an interrupted run leaves the
+    # store untouched. --rebuild writes a single segment from scratch and
+    # drops the old ones once the manifest no longer lists them.
+    if os.path.isfile(store_path):
+        raise ValueError(
+            f"{store_path} is a single NetCDF file; ingest appends to a segmented "
+            "store, so point DATA_PATH at a directory"
+        )
+    files = find_raw_files(paths)
+    if not files:
+        raise FileNotFoundError("No raw NLDAS files found")
+
+    manifest = None if rebuild else read_segments(store_path)
+    segments = manifest['segments'] if manifest else []
+    known = np.array([], dtype='datetime64[ns]')
+    grid = None
+    for name in segments:
+        with netCDF4.Dataset(os.path.join(store_path, name)) as nc:
+            known = np.concatenate([known, _stored_times(nc)])
+            if grid is None:
+                grid = nc.variables['lat'][:], nc.variables['lon'][:]
+
+    pending = [f for f in files if np.datetime64(file_timestamp(f), 'ns') not in known]
+    if not pending:
+        log("Store is up to date")
+        return 0
+    if len(known) and np.datetime64(file_timestamp(pending[0]), 'ns') <= known[-1]:
+        raise ValueError(
+            f"{os.path.basename(pending[0])} predates the end of the store; "
+            "re-run with --rebuild to insert it"
+        )
+
+    os.makedirs(store_path, exist_ok=True)
+    # Segment numbers keep increasing across rebuilds, so a new segment never
+    # reuses the name of a file a reader may still have open
+    numbers = [int(name.split('-')[0]) for name in os.listdir(store_path) if name.endswith('.nc')]
+    number = max(numbers, default=0) + 1
+    target = os.path.join(store_path, f'.{number:06d}.{os.getpid()}.tmp')
+
+    written = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Submit in batches so decoded days do not pile up ahead of the writer
+            batch = 2 * (workers or os.cpu_count() or 1)
+            results = chain.from_iterable(
+                pool.map(read_raw_file, pending[i:i + batch])
+                for i in range(0, len(pending), batch)
+            )
+            first = next(results)
+            _, lats, lons, _, attrs = first
+            if grid is None:
+                grid = lats, lons
+            _create_store(target, grid[0], grid[1], attrs, chunks, complevel)
+
+            with netCDF4.Dataset(target, 'a') as nc:
+                time = nc.variables['time']
+                for path, (times, lats, lons, arrays, _) in zip(pending, chain([first], results)):
+                    if not (np.allclose(grid[0], lats) and np.allclose(grid[1], lons)):
+                        raise ValueError(f"{os.path.basename(path)} is on a different grid than the store")
+                    start = len(time)
+                    stop = start + len(times)
+                    for var, values in arrays.items():
+                        nc.variables[var][start:stop, 0, :, :] = np.ma.masked_invalid(values)
+                    time[start:stop] = netCDF4.date2num(
+                        pd.to_datetime(times).to_pydatetime(), time.units, time.calendar)
+                    written += len(times)
+                    log(f"{os.path.basename(path)}: {len(times)} timestep(s)")
+                name = _segment_name(number, _stored_times(nc))
+        os.replace(target, os.path.join(store_path, name))
+    except BaseException:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+
+    write_segments(store_path, segments + [name])
+    if rebuild:
+        for old in os.listdir(store_path):
+            if old.endswith('.nc') and old != name:
+                os.remove(os.path.join(store_path, old))
+    return written
@@ -0,0 +1,80 @@
+import numpy as np
+
+# Smallest number of grid cells per timestep worth sending; below that the
+# time axis is decimated instead of thinning the map any further
+MIN_CELLS_PER_STEP = 1000
+
+
+def _index_range(coords, low, high):
+    # Positions [start, stop) of the ascending coordinate values within [low, high]
+    return (int(np.searchsorted(coords, low, side='left')),
+            int(np.searchsorted(coords, high, side='right')))
+
+
+def _strided(start, stop, stride):
+    # Anchor the stride to the dataset origin rather than to the window, so the
+    # same cells are picked whatever the bbox and coarser levels nest in finer ones
+    first = -(-start // stride) * stride
+    return slice(first, stop, stride), len(range(first, stop, stride))
+
+
+def _next_power_of_two(value):
+    return 1 << max(0, int(np.ceil(np.log2(max(value, 1)))))
+
+
+def snap_bbox(bbox, resolution):
+    # Widen (min_lat, max_lat, min_lon, max_lon) outward to multiples of the
+    # grid spacing, so nearby windows share one cache entry
+    min_lat, max_lat, min_lon, max_lon = (round(v / resolution, 9) for v in bbox)
+    return (
+        float(np.floor(min_lat) * resolution),
+        float(np.ceil(max_lat) * resolution),
+        float(np.floor(min_lon) * resolution),
+        float(np.ceil(max_lon) * resolution),
+    )
+
+
+def plan_lod(data, start_np, end_np, bbox, max_points=None):
+    # Work out isel() indexers for a query window from the coordinate indexes
+    # alone. With max_points set, pick the smallest power-of-two strides that
+    # keep time x lat x lon under the budget; no data is read to decide.
+    min_lat, max_lat, min_lon, max_lon = bbox
+    lats = data['lat'].values
+    lons = data['lon'].values
+    t0, t1 = _index_range(data['time'].values, start_np, end_np)
+    y0, y1 = _index_range(lats, min_lat, max_lat)
+    x0, x1 = _index_range(lons, min_lon, max_lon)
+    n_time, n_lat, n_lon = max(t1 - t0, 0), max(y1 - y0, 0), max(x1 - x0, 0)
+
+    time_stride = stride = 1
+    if max_points is not None and n_time * n_lat * n_lon > max_points:
+        per_step = max_points / max(n_time, 1)
+        if per_step < MIN_CELLS_PER_STEP:
+            time_stride = _next_power_of_two(n_time * MIN_CELLS_PER_STEP / max_points)
+        n_steps = _strided(t0, t1, time_stride)[1]
+        stride = _next_power_of_two(np.sqrt(n_steps * n_lat * n_lon / max_points))
+        while stride < max(n_lat, n_lon):
+            if n_steps * _strided(y0, y1, stride)[1] * _strided(x0, x1, stride)[1] <= max_points:
+                break
+            stride *= 2
+
+    time_slice, n_time = _strided(t0, t1, time_stride)
+    lat_slice, n_lat = _strided(y0, y1, stride)
+    lon_slice, n_lon = _strided(x0, x1, stride)
+
+    resolution = float(lats[1] - lats[0]) if len(lats) > 1 else 0.0
+    lod = {
+        'stride': stride,
+        'time_stride': time_stride,
+        'resolution': round(resolution * stride, 6),
+        'shape': [n_time, n_lat, n_lon],
+    }
+    return {'time': time_slice, 'lat': lat_slice, 'lon': lon_slice}, lod
+
+
+def lod_headers(lod):
+    return {
+        'X-LOD-Stride': str(lod['stride']),
+        'X-LOD-Time-Stride': str(lod['time_stride']),
+        'X-LOD-Resolution': str(lod['resolution']),
+    }
@@ -0,0 +1,125 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTERS = ('rows_in', 'rows_out', 'bytes_out')
+
+
+class Registry:
+    # Process-wide totals. Under several workers every process keeps its own,
+    # so scrape each worker or aggregate on the collector side.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = {}   # (endpoint, status) -> count
+        self.latency = {}    # endpoint -> [bucket counts..., +Inf count, sum]
+        self.stages = {}     # (endpoint, stage) -> [count, seconds]
+        self.counters = {}   # (endpoint, counter) -> total
+
+    def record(self, endpoint, status, seconds, stages, counters):
+        with self._lock:
+            key = (endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            buckets = self.latency.setdefault(endpoint, [0] * (len(LATENCY_BUCKETS) + 2))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            buckets[-2] += 1
+            buckets[-1] += seconds
+
+            for name, duration in stages:
+                entry = self.stages.setdefault((endpoint, name), [0, 0.0])
+                entry[0] += 1
+                entry[1] += duration
+            for name, value in counters.items():
+                self.counters[(endpoint, name)] = self.counters.get((endpoint, name), 0) + value
+
+    def render(self, extra=()):
+        # Prometheus text exposition format
+        lines = ['# TYPE nldas_requests_total counter']
+        with self._lock:
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'nldas_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+            lines.append('# TYPE nldas_request_seconds histogram')
+            for endpoint, buckets in sorted(self.latency.items()):
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(f'nldas_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'nldas_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {buckets[-2]}')
+                lines.append(f'nldas_request_seconds_count{{endpoint="{endpoint}"}} {buckets[-2]}')
+                lines.append(f'nldas_request_seconds_sum{{endpoint="{endpoint}"}} {buckets[-1]:.6f}')
+
+            lines.append('# TYPE nldas_stage_seconds summary')
+            for (endpoint, stage), (count, seconds) in sorted(self.stages.items()):
+                labels = f'endpoint="{endpoint}",stage="{stage}"'
+                lines.append(f'nldas_stage_seconds_count{{{labels}}} {count}')
+                lines.append(f'nldas_stage_seconds_sum{{{labels}}} {seconds:.6f}')
+
+            for name in COUNTERS:
+                lines.append(f'# TYPE nldas_{name}_total counter')
+                for (endpoint, counter), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f'nldas_{name}_total{{endpoint="{endpoint}"}} {value}')
+
+        for name, kind, samples in extra:
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+                lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+@contextmanager
+def stage(name):
+    # Time a named step of the current request; a no-op outside requests
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and 'timings' in g:
+            g.timings.append((name, time.perf_counter() - started))
+
+
+def count(name, value):
+    if has_request_context() and 'counters' in g:
+        g.counters[name] = g.counters.get(name, 0) + int(value)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.timings = []
+    g.counters = {}
+
+
+def _finish_request(response):
+    if 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    if not response.is_streamed:
+        count('bytes_out', response.calculate_content_length() or 0)
+
+    timings = g.timings + [('total', total)]
+    response.headers['Server-Timing'] = ', '.join(
+        f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings)
+
+    endpoint = request.endpoint or 'unmatched'
+    if endpoint != 'main.metrics':
+        registry.record(endpoint, response.status_code, total, g.timings, g.counters)
+    return response
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -1,21 +1,146 @@
-from flask import Blueprint, render_template, jsonify, request, current_app
-import xarray as xr
-import pandas as pd
+from flask import Blueprint, render_template, jsonify, request, current_app, Response, abort
+import zlib
 import numpy as np
-import os
-from datetime import datetime
+from app.backend import in_serving_units, open_backend
+from app.cache import LRUCache
+from app.contours import DEFAULT_LEVELS, MAX_LEVELS, to_geojson, window_contours
+from app.grid import STATISTICS, TIME_REDUCTIONS, aggregate_grid, encode_grid
+from app.lod import lod_headers, plan_lod, snap_bbox
+from app.metrics import count, registry, stage
+from app.serializers import (
+    BINARY_MIMETYPE, crop_columns, decode_binary, encode_binary, encode_columns, encode_rows,
+    extract_points, negotiate_format,
+)
+from app.stats import close_stats, load_stats, query_stats
+from app.store import file_version
+from app.tiles import MAX_ZOOM, TILE_VARIABLES, TileService, resolve_time
 
 main_bp = Blueprint('main', __name__)
 
-# Cache for the dataset
-_dataset = None
+# Serving variables for this worker, reopened when a new version is published
+_backend = None
 
-def get_dataset():
-    global _dataset
-    if _dataset is None:
-        data_path = os.path.join(current_app.root_path, '..', 'data', 'combined_data.nc')
-        _dataset = xr.open_dataset(data_path)
-    return _dataset
+# Rendered map tiles, created on first use
+_tile_service = None
+
+# Contour lines per (version, time, levels, simplification, tile)
+_contour_cache = None
+
+# Precomputed statistics and the version of the sidecar file they came from
+_stats = None
+_stats_version = None
+
+# Finished /api/data payloads and the dataset version they were built from
+_response_cache = None
+_response_cache_version = None
+
+# Upper bound on the number of points returned by /api/data
+MAX_POINTS = 10000
+
+# NLDAS grid spacing and the cell sizes accepted by /api/grid, in degrees
+GRID_RESOLUTION = 0.125
+DEFAULT_CELL_SIZE = 0.5
+MAX_CELL_SIZE = 10.0
+
+def get_backend():
+    global _backend
+    if _backend is not None and not _backend.is_current():
+        current_app.logger.info("Dataset version %s superseded, reloading", _backend.version)
+        _backend.close()
+        _backend = None
+    if _backend is None:
+        _backend = open_backend(current_app.config['DATA_PATH'], current_app.config['BACKEND_DIR'])
+    return _backend
+
+def parse_bbox(args):
+    # Raises ValueError for a missing or non-numeric edge; the endpoints
+    # answer it with a 400
+    bbox = []
+    for name in ('min_lat', 'max_lat', 'min_lon', 'max_lon'):
+        value = args.get(name)
+        if value is None:
+            raise ValueError(f"{name} is required")
+        try:
+            value = float(value)
+        except ValueError:
+            value = np.nan
+        if not np.isfinite(value):
+            raise ValueError(f"{name} must be a finite number")
+        bbox.append(value)
+    return tuple(bbox)
+
+def parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        raise ValueError(f"{name} is required")
+    try:
+        date = np.datetime64(value)
+    except ValueError:
+        date = np.datetime64('NaT')
+    if np.isnat(date):
+        raise ValueError(f"{name} must be a date such as 2024-06-01")
+    return date
+
+def parse_window(args):
+    # Date range and bbox shared by the data endpoints
+    return parse_date(args, 'start_date'), parse_date(args, 'end_date'), parse_bbox(args)
+
+def normalize_date(value):
+    return np.datetime_as_string(np.datetime64(value, 's'), unit='s')
+
+def get_response_cache(version):
+    # Entries are keyed on the dataset version; once a new version is being
+    # served the old entries can never hit again, so drop them
+    global _response_cache, _response_cache_version
+    if _response_cache is None:
+        _response_cache = LRUCache(
+            current_app.config['RESPONSE_CACHE_BYTES'],
+            sizeof=lambda entry: len(entry[0]),
+        )
+    if _response_cache_version != version:
+        _response_cache.clear()
+        _response_cache_version = version
+    return _response_cache
+
+def select_temperature(start_np, end_np, bbox, max_points=None):
+    # 2 m temperature over the window, dims (time, lat, lon), still lazy:
+    # in_serving_units reads it and converts to Celsius. With max_points set
+    # the window is decimated by the level-of-detail plan while indexing, so
+    # only the cells that are returned get read.
+    temperature = get_backend().variables['TMP']
+    indexers, lod = plan_lod(temperature, start_np, end_np, bbox, max_points)
+    return temperature.isel(indexers), lod
+
+def get_contour_cache():
+    global _contour_cache
+    if _contour_cache is None:
+        _contour_cache = LRUCache(
+            current_app.config['CONTOUR_CACHE_BYTES'],
+            sizeof=lambda entry: entry[1],
+        )
+    return _contour_cache
+
+def get_stats():
+    # Reload the sidecar whenever build-stats has rewritten it
+    global _stats, _stats_version
+    path = current_app.config['STATS_PATH']
+    version = file_version(path)
+    if _stats is None or _stats_version != version:
+        if _stats is not None:
+            close_stats(_stats)
+        _stats = load_stats(path)
+        _stats_version = version
+    return _stats
+
+def get_tile_service():
+    global _tile_service
+    if _tile_service is None:
+        _tile_service = TileService(
+            current_app.config['TILE_CACHE_DIR'],
+            current_app.config['TILE_CACHE_BYTES'],
+            disk_max_zoom=current_app.config['TILE_DISK_MAX_ZOOM'],
+        )
+    return _tile_service
 
 @main_bp.route('/')
 def index():
@@ -24,85 +149,252 @@ def index():
 @main_bp.route('/api/data')
 def get_data():
     try:
-        # Log request parameters
-        print("Received request parameters:")
-        print(f"Query args: {dict(request.args)}")
-
-        # Get query parameters
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        min_lat = float(request.args.get('min_lat'))
-        max_lat = float(request.args.get('max_lat'))
-        min_lon = float(request.args.get('min_lon'))
-        max_lon = float(request.args.get('max_lon'))
+        try:
+            fmt = negotiate_format(request.args, request.accept_mimetypes)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         # Get cached dataset
-        ds = get_dataset()
-        print(f"Dataset dimensions: {ds.dims}")
-        print(f"Dataset variables: {list(ds.variables)}")
-
-        # Convert dates to numpy datetime64
-        start_np = np.datetime64(start_date)
-        end_np = np.datetime64(end_date)
-        print(f"Processing data from {start_np} to {end_np}")
-
-        # Select temperature data
-        temp_data = ds['TMP'].sel(
-            time=slice(start_np, end_np),
-            lat=slice(min_lat, max_lat),
-            lon=slice(min_lon, max_lon),
-            height=2.0  # Select surface temperature
-        )
-        print(f"Selected data shape: {temp_data.shape}")
-
-        # Convert to DataFrame
-        df = temp_data.to_dataframe().reset_index()
-        print(f"Initial dataframe size: {len(df)}")
-        
-        # Drop rows with NaN values
-        df = df.dropna(subset=['TMP'])
-        print(f"Dataframe size after dropping NaN: {len(df)}")
-
-        # Convert temperature from Kelvin to Celsius
-        df['TMP'] = (df['TMP'] - 273.15).round(2)
-        
-        # Round coordinates
-        df['lat'] = df['lat'].round(3)
-        df['lon'] = df['lon'].round(3)
-
-        # Optimize data points if too many
-        if len(df) > 10000:
-            print(f"Reducing data points from {len(df)} to 10000")
-            df = df.sample(n=10000, random_state=42)
-
-        # Convert to records efficiently
-        result = df.apply(
-            lambda row: {
-                'lat': float(row['lat']),
-                'lon': float(row['lon']),
-                'value': float(row['TMP']),
-                'time': row['time'].isoformat()
-            },
-            axis=1
-        ).tolist()
-
-        print(f"Returning {len(result)} data points")
-        return jsonify(result)
+        try:
+            start_np, end_np, bbox = parse_window(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with stage('backend'):
+            backend = get_backend()
+
+        # Repeat views of nearby windows are answered from the response cache,
+        # keyed on the bbox snapped outward to the grid and normalized dates
+        with stage('cache'):
+            cache = get_response_cache(backend.version)
+            snapped = snap_bbox(bbox, GRID_RESOLUTION)
+            key = (backend.version, normalize_date(start_np), normalize_date(end_np), snapped, MAX_POINTS)
+            entry = cache.get(key)
+            if entry is not None:
+                stored, compressed, lod = entry
+                payload = zlib.decompress(stored) if compressed else stored
+        if entry is not None:
+            cache_status = 'HIT'
+        else:
+            with stage('selection'):
+                temp_data, lod = select_temperature(start_np, end_np, snapped, max_points=MAX_POINTS)
+
+            # Flatten the valid cells straight from the arrays
+            with stage('decode'):
+                columns = extract_points(in_serving_units(temp_data))
+            with stage('encode'):
+                payload = encode_binary(columns)
+                compressed = current_app.config['RESPONSE_CACHE_COMPRESS']
+                cache.put(key, (zlib.compress(payload, 1) if compressed else payload, compressed, lod))
+            cache_status = 'MISS'
+
+        # Crop the snapped window back to the requested bbox
+        with stage('crop'):
+            full = decode_binary(payload)
+            columns = crop_columns(full, bbox)
+        count('rows_in', np.prod(lod['shape']))
+        count('rows_out', len(columns['value']))
+
+        with stage('serialize'):
+            if fmt == 'binary':
+                body = payload if columns is full else encode_binary(columns)
+                response = Response(body, mimetype=BINARY_MIMETYPE)
+            elif fmt == 'columns':
+                response = jsonify(dict(encode_columns(columns), lod=lod))
+            else:
+                response = jsonify(encode_rows(columns))
+        response.headers.update(lod_headers(lod))
+        response.headers['X-Cache'] = cache_status
+        return response
 
     except Exception as e:
-        print(f"Error processing data: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
-        return jsonify({
-            "error": str(e),
-            "traceback": traceback.format_exc()
-        }), 500
+        current_app.logger.exception("Error processing data")
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route('/api/grid')
+def get_grid():
+    try:
+        try:
+            cell_size = float(request.args.get('cell_size', DEFAULT_CELL_SIZE))
+        except ValueError:
+            cell_size = np.nan
+        time_reduce = request.args.get('time_reduce', 'mean').lower()
+        statistics = request.args.get('stats', ','.join(STATISTICS)).lower().split(',')
+
+        # Cells are whole blocks of grid points, so only multiples of the grid
+        # spacing give cells of equal size
+        cells = cell_size / GRID_RESOLUTION
+        if not (GRID_RESOLUTION <= cell_size <= MAX_CELL_SIZE and np.isclose(cells, round(cells))):
+            return jsonify({"error": f"cell_size must be a multiple of {GRID_RESOLUTION} "
+                                     f"between {GRID_RESOLUTION} and {MAX_CELL_SIZE} degrees"}), 400
+        if time_reduce not in TIME_REDUCTIONS:
+            return jsonify({"error": f"time_reduce must be one of {', '.join(TIME_REDUCTIONS)}"}), 400
+        unknown = [name for name in statistics if name not in STATISTICS]
+        if unknown:
+            return jsonify({"error": f"Unknown statistics: {', '.join(unknown)}"}), 400
+        try:
+            start_np, end_np, bbox = parse_window(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        with stage('backend'):
+            get_backend()
+        with stage('selection'):
+            temp_data, _ = select_temperature(start_np, end_np, bbox)
+        with stage('reduce'):
+            result = aggregate_grid(temp_data, cell_size, time_reduce, statistics)
+        count('rows_in', temp_data.size)
+        count('rows_out', len(result['lat']) * len(result['lon']))
+        with stage('serialize'):
+            return jsonify(encode_grid(result, cell_size, time_reduce))
+
+    except Exception as e:
+        current_app.logger.exception("Error processing grid")
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route('/tiles/<var>/<time>/<int:z>/<int:x>/<int:y>.png')
+def get_tile(var, time, z, x, y):
+    if var not in TILE_VARIABLES or not 0 <= z <= MAX_ZOOM:
+        abort(404)
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        abort(404)
+
+    with stage('backend'):
+        backend = get_backend()
+    data = backend.variables[var]
+    try:
+        timestep = resolve_time(data, time)
+    except (LookupError, ValueError):
+        abort(404)
+
+    with stage('render'):
+        png = get_tile_service().get_tile(data, backend.version, var, timestep, z, x, y)
+    response = Response(png, mimetype='image/png')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@main_bp.route('/api/contours')
+def get_contours():
+    try:
+        levels = request.args.get('levels')
+        try:
+            levels = tuple(sorted({float(v) for v in levels.split(',')})) if levels else DEFAULT_LEVELS
+        except ValueError:
+            levels = None
+        if levels is None or not np.isfinite(levels).all():
+            return jsonify({"error": "levels must be a comma-separated list of finite numbers"}), 400
+        if not 0 < len(levels) <= MAX_LEVELS:
+            return jsonify({"error": f"Between 1 and {MAX_LEVELS} levels are supported"}), 400
+        try:
+            tolerance = float(request.args.get('simplify', 0))
+        except ValueError:
+            tolerance = None
+        if tolerance is None or not (np.isfinite(tolerance) and tolerance >= 0):
+            return jsonify({"error": "simplify must be a finite, non-negative number"}), 400
+        when = request.args.get('time') or request.args.get('start_date')
+        if not when:
+            return jsonify({"error": "time is required"}), 400
+        try:
+            bbox = parse_bbox(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with stage('backend'):
+            backend = get_backend()
+        data = backend.variables['TMP']
+        try:
+            timestep = resolve_time(data, when)
+        except (LookupError, ValueError) as e:
+            return jsonify({"error": str(e)}), 404
+
+        with stage('contours'):
+            lines = window_contours(data, timestep, bbox, levels, tolerance,
+                                    get_contour_cache(), backend.version)
+        count('rows_out', sum(len(line) for level_lines in lines.values() for line in level_lines))
+        with stage('serialize'):
+            result = to_geojson(lines)
+            result['time'] = normalize_date(timestep)
+            return jsonify(result)
+
+    except Exception as e:
+        current_app.logger.exception("Error processing contours")
+        return jsonify({"error": str(e)}), 500
+
+@main_bp.route('/api/stats')
+def get_statistics():
+    try:
+        try:
+            start_np, end_np, bbox = parse_window(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        with stage('backend'):
+            backend = get_backend()
+            try:
+                stats = get_stats()
+            except FileNotFoundError:
+                return jsonify({"error": "Statistics have not been built; run 'flask build-stats'"}), 503
+
+        with stage('query'):
+            result = query_stats(stats, start_np, end_np, bbox)
+        count('rows_out', len(result['days']))
+        source_version = stats['attrs']['source_version']
+        result['version'] = source_version
+        # Compared with the store the served data came from, not the publish
+        result['stale'] = source_version != backend.source_version
+        with stage('serialize'):
+            return jsonify(result)
+
+    except Exception as e:
+        current_app.logger.exception("Error processing statistics")
+        return jsonify({"error": str(e)}), 500
 
 # Optional: Add endpoint to clear dataset cache
 @main_bp.route('/api/clear-cache', methods=['POST'])
 def clear_cache():
-    global _dataset
-    if _dataset is not None:
-        _dataset.close()
-        _dataset = None
-    return jsonify({"message": "Cache cleared"})
\ No newline at end of file
+    global _backend
+    if _backend is not None:
+        _backend.close()
+        _backend = None
+    if _tile_service is not None:
+        _tile_service.tiles.clear()
+        _tile_service.fields.clear()
+    if _response_cache is not None:
+        _response_cache.clear()
+    if _contour_cache is not None:
+        _contour_cache.clear()
+    return jsonify({"message": "Cache cleared"})
+
+@main_bp.route('/api/cache-stats')
+def cache_stats():
+    stats = {}
+    if _response_cache is not None:
+        stats['responses'] = dict(_response_cache.stats(), version=_response_cache_version)
+    if _tile_service is not None:
+        stats['tiles'] = _tile_service.tiles.stats()
+        stats['tile_fields'] = _tile_service.fields.stats()
+    if _contour_cache is not None:
+        stats['contours'] = _contour_cache.stats()
+    return jsonify(stats)
+
+def _cache_samples():
+    caches = {
+        'responses': _response_cache,
+        'contours': _contour_cache,
+        'tiles': _tile_service.tiles if _tile_service is not None else None,
+    }
+    samples = {'hits': [], 'misses': [], 'bytes': []}
+    for name, cache in caches.items():
+        if cache is None:
+            continue
+        cache_stats = cache.stats()
+        for field in samples:
+            samples[field].append(({'cache': name}, cache_stats[field]))
+    return [
+        ('nldas_cache_hits_total', 'counter', samples['hits']),
+        ('nldas_cache_misses_total', 'counter', samples['misses']),
+        ('nldas_cache_bytes', 'gauge', samples['bytes']),
+    ]
+
+@main_bp.route('/metrics')
+def metrics():
+    return Response(registry.render(_cache_samples()), mimetype='text/plain; version=0.0.4')
\ No newline at end of file
@@ -0,0 +1,121 @@
+import struct
+
+import numpy as np
+
+# Binary payload layout (all little-endian):
+#   header   : magic b'TMPB', uint32 version, uint32 point count, uint32 time count
+#   times    : float64[time count]  - milliseconds since the Unix epoch
+#   lat      : float32[point count]
+#   lon      : float32[point count]
+#   value    : float32[point count]  - temperature in degrees Celsius
+#   time_idx : uint32[point count]   - index into the times table
+# The header is 16 bytes and the times table is 8-byte aligned, so every column
+# starts on a boundary that lets main.js wrap it in a typed array without copying.
+BINARY_MAGIC = b'TMPB'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sIII')
+BINARY_MIMETYPE = 'application/octet-stream'
+
+FORMATS = ('json', 'columns', 'binary')
+
+
+def extract_points(temp_data):
+    # Flatten a (time, lat, lon) DataArray into parallel columns, keeping only
+    # the cells that hold data. Nothing goes through pandas: the NaN mask gives
+    # the indices and the coordinate vectors are gathered with them.
+    temp_data = temp_data.transpose('time', 'lat', 'lon')
+    values = np.asarray(temp_data.values)
+    time_idx, lat_idx, lon_idx = np.nonzero(~np.isnan(values))
+
+    return {
+        'lat': temp_data['lat'].values[lat_idx],
+        'lon': temp_data['lon'].values[lon_idx],
+        'value': values[time_idx, lat_idx, lon_idx],
+        'time_index': time_idx.astype(np.uint32),
+        'times': temp_data['time'].values,
+    }
+
+
+def _iso_times(times):
+    return np.datetime_as_string(np.asarray(times, dtype='datetime64[s]'), unit='s').tolist()
+
+
+def encode_rows(columns):
+    # Legacy layout: one object per point. Kept as the default so existing
+    # clients keep working, but built from the rounded columns in one pass.
+    times = _iso_times(columns['times'])
+    return [
+        {'lat': lat, 'lon': lon, 'value': value, 'time': times[t]}
+        for lat, lon, value, t in zip(
+            np.round(columns['lat'].astype(np.float64), 3).tolist(),
+            np.round(columns['lon'].astype(np.float64), 3).tolist(),
+            np.round(columns['value'].astype(np.float64), 2).tolist(),
+            columns['time_index'].tolist(),
+        )
+    ]
+
+
+def encode_columns(columns):
+    return {
+        'count': int(len(columns['value'])),
+        'times': _iso_times(columns['times']),
+        'lat': np.round(columns['lat'].astype(np.float64), 3).tolist(),
+        'lon': np.round(columns['lon'].astype(np.float64), 3).tolist(),
+        'value': np.round(columns['value'].astype(np.float64), 2).tolist(),
+        'time_index': columns['time_index'].tolist(),
+    }
+
+
+def encode_binary(columns):
+    times = np.asarray(columns['times'], dtype='datetime64[ms]').astype('<f8')
+    count = len(columns['value'])
+    return b''.join([
+        BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, count, len(times)),
+        times.tobytes(),
+        np.asarray(columns['lat'], dtype='<f4').tobytes(),
+        np.asarray(columns['lon'], dtype='<f4').tobytes(),
+        np.asarray(columns['value'], dtype='<f4').tobytes(),
+        np.asarray(columns['time_index'], dtype='<u4').tobytes(),
+    ])
+
+
+def decode_binary(payload):
+    # Inverse of encode_binary; the columns are read-only views over payload
+    magic, version, count, time_count = BINARY_HEADER.unpack_from(payload)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("Unexpected binary payload")
+    offset = BINARY_HEADER.size
+    times = np.frombuffer(payload, dtype='<f8', count=time_count, offset=offset)
+    offset += times.nbytes
+    columns = {'times': times.astype('datetime64[ms]')}
+    for name, dtype in (('lat', '<f4'), ('lon', '<f4'), ('value', '<f4'), ('time_index', '<u4')):
+        columns[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+        offset += columns[name].nbytes
+    return columns
+
+
+def crop_columns(columns, bbox):
+    # Keep the points inside (min_lat, max_lat, min_lon, max_lon). Returns the
+    # columns untouched when nothing falls outside.
+    # Compared in float32, the precision the binary columns are stored at
+    min_lat, max_lat, min_lon, max_lon = np.float32(bbox)
+    lat, lon = columns['lat'], columns['lon']
+    inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+    if inside.all():
+        return columns
+    cropped = {name: values[inside] for name, values in columns.items() if name != 'times'}
+    cropped['times'] = columns['times']
+    return cropped
+
+
+def negotiate_format(args, accept_mimetypes):
+    # An explicit ?format= wins; otherwise honour the Accept header, preferring
+    # JSON so that browsers sending */* keep getting the legacy response.
+    requested = args.get('format')
+    if requested:
+        requested = requested.lower()
+        if requested not in FORMATS:
+            raise ValueError(f"Unsupported format '{requested}', expected one of {', '.join(FORMATS)}")
+        return requested
+    best = accept_mimetypes.best_match(['application/json', BINARY_MIMETYPE])
+    return 'binary' if best == BINARY_MIMETYPE else 'json'
@@ -96,6 +96,7 @@ function validateDates() {
                 <option value="heatmap">Heatmap</option>
                 <option value="grid">Grid Cells</option>
                 <option value="contour">Contour Lines</option>
+                <option value="tiles">Raster Tiles</option>
             </select>
         `;
         return div;
@@ -165,9 +166,13 @@ function validateDates() {
     };
     legend.addTo(map);
 
+    const GRID_SIZE = 0.5; // Cell size in degrees requested from /api/grid
+    const CONTOUR_SIMPLIFY = 0.02; // Simplification tolerance in degrees for /api/contours
+
     // Initialize layers
     let temperatureLayer = L.layerGroup().addTo(map);
     let heatmapLayer = null;
+    let rasterLayer = null;
 
     // Function to create different visualizations
     function createVisualization(data, type) {
@@ -176,28 +181,31 @@ function validateDates() {
             map.removeLayer(heatmapLayer);
             heatmapLayer = null;
         }
+        if (rasterLayer) {
+            map.removeLayer(rasterLayer);
+            rasterLayer = null;
+        }
     
         // Remove any existing mousemove handler
         map.off('mousemove');
     
-        const GRID_SIZE = 0.5; // Global grid size for all visualizations
-    
         switch(type) {
             case 'circles':
-                data.forEach(point => {
-                    const color = getColor(point.value);
-                    L.circleMarker([point.lat, point.lon], {
+                // data holds the typed columns from decodeBinaryPoints
+                for (let i = 0; i < data.count; i++) {
+                    const color = getColor(data.value[i]);
+                    L.circleMarker([data.lat[i], data.lon[i]], {
                         color: color,
                         fillColor: color,
                         fillOpacity: 0.4,
                         radius: 5,
                         weight: 0.5
                     }).bindPopup(
-                        `Temperature: ${point.value.toFixed(1)}°C<br>` +
-                        `Location: ${point.lat.toFixed(2)}°N, ${point.lon.toFixed(2)}°W<br>` +
-                        `Time: ${new Date(point.time).toLocaleString()}`
+                        `Temperature: ${data.value[i].toFixed(1)}°C<br>` +
+                        `Location: ${data.lat[i].toFixed(2)}°N, ${data.lon[i].toFixed(2)}°W<br>` +
+                        `Time: ${new Date(data.times[data.timeIndex[i]]).toLocaleString()}`
                     ).addTo(temperatureLayer);
-                });
+                }
                 break;
     
                 case 'heatmap':
@@ -213,22 +221,19 @@ function validateDates() {
                     const bounds = map.getBounds();
                     
                     // Sample data points if there are too many
-                    let processedData = data;
-                    if (data.length > MAX_POINTS) {
-                        const skipFactor = Math.ceil(data.length / MAX_POINTS);
-                        processedData = data.filter((_, index) => index % skipFactor === 0);
-                    }
+                    const skipFactor = Math.max(1, Math.ceil(data.count / MAX_POINTS));
                 
-                    // Create spatial index for faster point lookup
+                    // Create spatial index for faster point lookup; it holds
+                    // row numbers into the typed columns rather than point objects
                     const pointIndex = new Map();
-                    processedData.forEach(point => {
-                        const key = Math.floor(point.lat/SEARCH_RADIUS) + ',' + 
-                                   Math.floor(point.lon/SEARCH_RADIUS);
+                    for (let i = 0; i < data.count; i += skipFactor) {
+                        const key = Math.floor(data.lat[i]/SEARCH_RADIUS) + ',' + 
+                                   Math.floor(data.lon[i]/SEARCH_RADIUS);
                         if (!pointIndex.has(key)) {
                             pointIndex.set(key, []);
                         }
-                        pointIndex.get(key).push(point);
-                    });
+                        pointIndex.get(key).push(i);
+                    }
                 
                     // Calculate grid dimensions
                     const latRange = {
@@ -255,8 +260,8 @@ function validateDates() {
                                                 (Math.floor(lon/SEARCH_RADIUS) + dlon);
                                 const points = pointIndex.get(searchKey) || [];
                                 nearby.push(...points.filter(p => 
-                                    Math.sqrt(Math.pow(p.lat - lat, 2) + 
-                                            Math.pow(p.lon - lon, 2)) <= SEARCH_RADIUS
+                                    Math.sqrt(Math.pow(data.lat[p] - lat, 2) + 
+                                            Math.pow(data.lon[p] - lon, 2)) <= SEARCH_RADIUS
                                 ));
                             }
                         }
@@ -279,14 +284,14 @@ function validateDates() {
                                             let weightedSum = 0;
                                             let weightSum = 0;
                 
-                                            nearbyPoints.forEach(point => {
+                                            nearbyPoints.forEach(p => {
                                                 const dist = Math.sqrt(
-                                                    Math.pow(point.lat - lat, 2) + 
-                                                    Math.pow(point.lon - lon, 2)
+                                                    Math.pow(data.lat[p] - lat, 2) + 
+                                                    Math.pow(data.lon[p] - lon, 2)
                                                 );
                                                 
                                                 const weight = dist === 0 ? 1000 : 1 / Math.pow(dist, 2);
-                                                weightedSum += point.value * weight;
+                                                weightedSum += data.value[p] * weight;
                                                 weightSum += weight;
                                             });
                 
@@ -331,73 +336,68 @@ function validateDates() {
                     processGrid().catch(console.error);
                     break;
     
+            case 'tiles':
+                // Pre-rendered PNG tiles for one timestep; data is the date to show
+                rasterLayer = L.tileLayer(`/tiles/TMP/${data}/{z}/{x}/{y}.png`, {
+                    maxZoom: 14,
+                    opacity: 0.8
+                }).addTo(map);
+                break;
+
             case 'grid':
-                const grid = {};
-                
-                data.forEach(point => {
-                    const lat = Math.floor(point.lat / GRID_SIZE) * GRID_SIZE;
-                    const lon = Math.floor(point.lon / GRID_SIZE) * GRID_SIZE;
-                    const key = `${lat},${lon}`;
-                    
-                    if (!grid[key]) {
-                        grid[key] = { total: 0, count: 0 };
+                // Cells are aggregated server-side by /api/grid; data is its payload
+                const [rows, cols] = data.shape;
+                for (let i = 0; i < rows; i++) {
+                    for (let j = 0; j < cols; j++) {
+                        const k = i * cols + j;
+                        const avgTemp = data.mean[k];
+                        if (avgTemp === null) continue;
+                        const lat = data.lat[i];
+                        const lon = data.lon[j];
+                        const bounds = [
+                            [lat, lon],
+                            [lat + data.cell_size, lon + data.cell_size]
+                        ];
+
+                        L.rectangle(bounds, {
+                            color: getColor(avgTemp),
+                            weight: 1,
+                            fillColor: getColor(avgTemp),
+                            fillOpacity: 0.7
+                        }).bindPopup(
+                            `Average Temperature: ${avgTemp.toFixed(1)}°C<br>` +
+                            `Range: ${data.min[k].toFixed(1)} to ${data.max[k].toFixed(1)}°C<br>` +
+                            `Grid points: ${data.count[k]}`
+                        ).addTo(temperatureLayer);
                     }
-                    grid[key].total += point.value;
-                    grid[key].count++;
-                });
-    
-                Object.entries(grid).forEach(([key, value]) => {
-                    const [lat, lon] = key.split(',').map(Number);
-                    const avgTemp = value.total / value.count;
-                    const bounds = [
-                        [lat, lon],
-                        [lat + GRID_SIZE, lon + GRID_SIZE]
-                    ];
-                    
-                    L.rectangle(bounds, {
-                        color: getColor(avgTemp),
-                        weight: 1,
-                        fillColor: getColor(avgTemp),
-                        fillOpacity: 0.7
-                    }).bindPopup(
-                        `Average Temperature: ${avgTemp.toFixed(1)}°C`
-                    ).addTo(temperatureLayer);
-                });
+                }
                 break;
     
             case 'contour':
-                const contourBreaks = [0, 10, 20, 30, 40];
-                contourBreaks.forEach((temp, i) => {
-                    if (i < contourBreaks.length - 1) {
-                        const filtered = data.filter(p => 
-                            p.value >= temp && p.value < contourBreaks[i + 1]
-                        );
-                        if (filtered.length > 0) {
-                            const color = getColor(temp);
-                            filtered.forEach(point => {
-                                L.circle([point.lat, point.lon], {
-                                    color: color,
-                                    fillColor: color,
-                                    fillOpacity: 0.6,
-                                    radius: 20000,
-                                    weight: 1
-                                }).addTo(temperatureLayer);
-                            });
-                        }
+                // Isotherms computed server-side by /api/contours; data is GeoJSON
+                L.geoJSON(data, {
+                    style: feature => ({
+                        color: getColor(feature.properties.level),
+                        weight: 2,
+                        opacity: 0.9
+                    }),
+                    onEachFeature: (feature, layer) => {
+                        layer.bindPopup(`Isotherm: ${feature.properties.level}°C`);
                     }
-                });
+                }).addTo(temperatureLayer);
                 break;
         }
     
         // Add mousemove handler for temperature display
+        if (!(data.value instanceof Float32Array)) return;
         map.on('mousemove', function(e) {
-            const nearestPoint = findNearestPoint(e.latlng, data);
-            if (nearestPoint) {
+            const nearest = findNearestPoint(e.latlng, data);
+            if (nearest !== null) {
                 const popup = L.popup()
                     .setLatLng(e.latlng)
                     .setContent(
-                        `Temperature: ${nearestPoint.value.toFixed(1)}°C<br>` +
-                        `Location: ${nearestPoint.lat.toFixed(2)}°N, ${nearestPoint.lon.toFixed(2)}°W`
+                        `Temperature: ${data.value[nearest].toFixed(1)}°C<br>` +
+                        `Location: ${data.lat[nearest].toFixed(2)}°N, ${data.lon[nearest].toFixed(2)}°W`
                     )
                     .openOn(map);
                 
@@ -406,18 +406,18 @@ function validateDates() {
         });
     }
     
-    // Helper function for finding nearest point
+    // Helper function for finding nearest point; returns its row in the columns
     function findNearestPoint(latlng, points) {
         let nearest = null;
         let minDist = Infinity;
         
-        points.forEach(point => {
-            const dist = map.distance(latlng, [point.lat, point.lon]);
+        for (let i = 0; i < points.count; i++) {
+            const dist = map.distance(latlng, [points.lat[i], points.lon[i]]);
             if (dist < minDist) {
                 minDist = dist;
-                nearest = point;
+                nearest = i;
             }
-        });
+        }
         
         return minDist < 50000 ? nearest : null;
     }    
@@ -436,6 +436,32 @@ function validateDates() {
     };
     loadingControl.addTo(map);
 
+    // Decode the binary /api/data payload (see app/serializers.py for the layout).
+    // Columns are wrapped as typed arrays over the response buffer and handed
+    // to the layers as they are, so no per-point objects are ever built.
+    function decodeBinaryPoints(buffer) {
+        const header = new DataView(buffer, 0, 16);
+        const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+        if (magic !== 'TMPB' || header.getUint32(4, true) !== 1) {
+            throw new Error('Unexpected binary payload');
+        }
+        const count = header.getUint32(8, true);
+        const timeCount = header.getUint32(12, true);
+
+        let offset = 16;
+        const times = new Float64Array(buffer, offset, timeCount);
+        offset += timeCount * 8;
+        const lat = new Float32Array(buffer, offset, count);
+        offset += count * 4;
+        const lon = new Float32Array(buffer, offset, count);
+        offset += count * 4;
+        const value = new Float32Array(buffer, offset, count);
+        offset += count * 4;
+        const timeIndex = new Uint32Array(buffer, offset, count);
+
+        return {count, times, lat, lon, value, timeIndex};
+    }
+
     // Function to fetch and display data
     async function fetchData() {
         try {
@@ -456,27 +482,62 @@ function validateDates() {
                         max_lon: bounds.getEast()
                     });
 
-            const response = await fetch(`/api/data?${params}`);
-            
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            const vizType = document.getElementById('vizType').value;
+
+            if (vizType === 'tiles') {
+                createVisualization(startDate, vizType);
+                updateStatus(`Displaying temperature tiles for ${startDate}`);
+                return;
+            }
+
+            if (vizType === 'contour') {
+                const contourParams = new URLSearchParams({
+                    time: startDate,
+                    min_lat: params.get('min_lat'),
+                    max_lat: params.get('max_lat'),
+                    min_lon: params.get('min_lon'),
+                    max_lon: params.get('max_lon'),
+                    simplify: CONTOUR_SIMPLIFY
+                });
+                const response = await fetch(`/api/contours?${contourParams}`);
+                const contours = await response.json();
+                if (!response.ok || contours.error) {
+                    throw new Error(contours.error || `HTTP error! status: ${response.status}`);
+                }
+
+                createVisualization(contours, vizType);
+                updateStatus(`Displaying isotherms for ${contours.time}`);
+                return;
             }
 
-            const data = await response.json();
+            if (vizType === 'grid') {
+                params.set('cell_size', GRID_SIZE);
+                const response = await fetch(`/api/grid?${params}`);
+                const grid = await response.json();
+                if (!response.ok || grid.error) {
+                    throw new Error(grid.error || `HTTP error! status: ${response.status}`);
+                }
 
-            if (data.error) {
-                throw new Error(data.error);
+                createVisualization(grid, vizType);
+                updateStatus(`Displaying ${grid.shape[0] * grid.shape[1]} grid cells for ${startDate} to ${endDate}`);
+                return;
             }
 
-            if (!Array.isArray(data)) {
-                throw new Error('Expected array of data points');
+            params.set('format', 'binary');
+            const response = await fetch(`/api/data?${params}`);
+            
+            if (!response.ok) {
+                const body = await response.json().catch(() => ({}));
+                throw new Error(body.error || `HTTP error! status: ${response.status}`);
             }
 
-            updateStatus(`Received ${data.length} data points`);
+            const data = decodeBinaryPoints(await response.arrayBuffer());
+            const resolution = response.headers.get('X-LOD-Resolution');
+
+            updateStatus(`Received ${data.count} data points`);
 
-            const vizType = document.getElementById('vizType').value;
             createVisualization(data, vizType);
-            updateStatus(`Displaying ${data.length} temperature points for ${startDate} to ${endDate}`);
+            updateStatus(`Displaying ${data.count} temperature points at ${resolution}° for ${startDate} to ${endDate}`);
 
         } catch (error) {
             console.error('Error:', error);
@@ -0,0 +1,224 @@
+import os
+
+import netCDF4
+import numpy as np
+import xarray as xr
+
+from app.backend import in_serving_units
+
+# Edge length, in grid cells, of the coarse tiles holding regional min/max
+TILE_CELLS = 16
+
+
+def _summed_area(values):
+    # 2-D prefix sums with a leading row and column of zeros, so the total over
+    # rows [y0, y1) and columns [x0, x1) is four lookups
+    out = np.zeros(values.shape[:-2] + (values.shape[-2] + 1, values.shape[-1] + 1), dtype=values.dtype)
+    out[..., 1:, 1:] = values.cumsum(axis=-2).cumsum(axis=-1)
+    return out
+
+
+def _tile_reduce(ufunc, values, fill):
+    # Reduce the trailing (lat, lon) axes over TILE_CELLS x TILE_CELLS tiles
+    *lead, ny, nx = values.shape
+    ty, tx = -(-ny // TILE_CELLS), -(-nx // TILE_CELLS)
+    padded = np.full(tuple(lead) + (ty * TILE_CELLS, tx * TILE_CELLS), fill, dtype=values.dtype)
+    padded[..., :ny, :nx] = values
+    blocks = padded.reshape(tuple(lead) + (ty, TILE_CELLS, tx, TILE_CELLS))
+    return ufunc.reduce(ufunc.reduce(blocks, axis=-1), axis=-2)
+
+
+def _create_sidecar(path, days, lats, lons):
+    # Day grids are stored contiguous and uncompressed, so a query reads only
+    # the cells it touches straight from the page cache, which every worker
+    # shares, instead of decompressing whole chunks into each process
+    nc = netCDF4.Dataset(path, 'w', format='NETCDF4')
+    ny, nx = len(lats), len(lons)
+    ty, tx = -(-ny // TILE_CELLS), -(-nx // TILE_CELLS)
+    for name, size in (('day', len(days)), ('lat', ny), ('lon', nx),
+                       ('lat_edge', ny + 1), ('lon_edge', nx + 1), ('tile_lat', ty), ('tile_lon', tx)):
+        nc.createDimension(name, size)
+
+    day = nc.createVariable('day', 'i8', ('day',))
+    day.units = 'days since 1970-01-01'
+    day[:] = days.astype('datetime64[D]').astype(np.int64)
+    for name, values in (('lat', lats), ('lon', lons),
+                         ('tile_lat', lats[::TILE_CELLS]), ('tile_lon', lons[::TILE_CELLS])):
+        nc.createVariable(name, 'f8', (name,))[:] = values
+
+    grid = ('day', 'lat', 'lon')
+    tiles = ('day', 'tile_lat', 'tile_lon')
+    edges = ('day', 'lat_edge', 'lon_edge')
+    for name, dtype, dims in (
+        ('daily_min', 'f4', grid), ('daily_max', 'f4', grid),
+        ('sat_sum', 'f8', edges), ('sat_count', 'i4', edges),
+        ('period_sat_sum', 'f8', edges[1:]), ('period_sat_count', 'i8', edges[1:]),
+        ('tile_min', 'f4', tiles), ('tile_max', 'f4', tiles),
+    ):
+        nc.createVariable(name, dtype, dims, contiguous=True)
+        nc.variables[name].set_auto_mask(False)
+    return nc
+
+
+def build_stats(data, source_version, path, log=print):
+    # Summarise the (time, lat, lon) serving variable into a sidecar NetCDF
+    # holding exactly what query_stats reads:
+    #   daily_min/max                 per cell and day
+    #   sat_sum/sat_count             per-day summed-area tables of sums and counts
+    #   period_sat_sum/_count         the same over the whole record
+    #   tile_min/max                  per day over TILE_CELLS x TILE_CELLS tiles
+    # The per-day arrays are about 20 bytes per cell and day, so they are
+    # written one day at a time as they are computed: memory is bounded by a
+    # day of raw data plus a few (lat, lon) planes.
+    lats, lons = data['lat'].values, data['lon'].values
+    days = data['time'].values.astype('datetime64[D]')
+    unique_days = np.unique(days)
+    plane = (len(lats), len(lons))
+
+    total_sum = np.zeros(plane, dtype=np.float64)
+    total_count = np.zeros(plane, dtype=np.int64)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with _create_sidecar(tmp_path, unique_days, lats, lons) as nc:
+            for d, day in enumerate(unique_days):
+                block = np.asarray(in_serving_units(data.isel(time=np.flatnonzero(days == day))).values,
+                                   dtype=np.float32)
+                valid = ~np.isnan(block)
+                count = valid.sum(axis=0)
+                total = np.where(valid, block, 0).sum(axis=0, dtype=np.float64)
+                low = np.fmin.reduce(block, axis=0)
+                high = np.fmax.reduce(block, axis=0)
+                total_sum += total
+                total_count += count
+
+                nc.variables['daily_min'][d] = low
+                nc.variables['daily_max'][d] = high
+                nc.variables['sat_sum'][d] = _summed_area(total)
+                nc.variables['sat_count'][d] = _summed_area(count.astype(np.int32))
+                nc.variables['tile_min'][d] = _tile_reduce(np.fmin, low, np.float32(np.nan))
+                nc.variables['tile_max'][d] = _tile_reduce(np.fmax, high, np.float32(np.nan))
+                log(f"{day}: {int(count.sum())} values")
+
+            nc.variables['period_sat_sum'][:] = _summed_area(total_sum)
+            nc.variables['period_sat_count'][:] = _summed_area(total_count)
+            nc.setncatts({'source_version': source_version, 'tile_cells': TILE_CELLS, 'units': 'degC'})
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+
+
+def load_stats(path):
+    # Open the sidecar without reading it: only the coordinates are loaded,
+    # the arrays are indexed lazily by query_stats. Close it with close_stats.
+    ds = xr.open_dataset(path, cache=False)
+    stats = {name: ds[name].variable for name in ds.data_vars}
+    stats.update({name: ds[name].values for name in ('day', 'lat', 'lon')})
+    stats['attrs'] = dict(ds.attrs)
+    stats['dataset'] = ds
+    return stats
+
+
+def close_stats(stats):
+    stats['dataset'].close()
+
+
+def _read(variable, *index):
+    return np.asarray(variable[index].values)
+
+
+def _box(table, days, y0, y1, x0, x1):
+    # Total over rows [y0, y1) and columns [x0, x1) from a summed-area table,
+    # reading only its four corners in one go (per day when days is a slice)
+    lead = () if days is None else (days,)
+    if y0 == y1 or x0 == x1:
+        return np.zeros(_read(table, *lead, y0, x0).shape, dtype=table.dtype)
+    corners = _read(table, *lead, [y0, y1], [x0, x1])
+    return corners[..., 1, 1] - corners[..., 0, 1] - corners[..., 1, 0] + corners[..., 0, 0]
+
+
+def _extreme(parts, ufunc, fill):
+    # Combine per-day partial extremes from several (day, ...) blocks, NaN-aware
+    result = None
+    for part in parts:
+        if part.size == 0 or part.shape[-1] == 0:
+            continue
+        flat = part.reshape(part.shape[0], -1)
+        reduced = ufunc.reduce(np.where(np.isnan(flat), fill, flat), axis=1)
+        result = reduced if result is None else ufunc(result, reduced)
+    return result
+
+
+def query_stats(stats, start_np, end_np, bbox):
+    # Statistics of a bbox over a date range, built only from the precomputed
+    # partials: means from the summed-area tables, extremes from whole tiles
+    # plus the per-cell daily extremes of the strips along the bbox edges.
+    # Only those corners, tiles and strips are read from the sidecar.
+    min_lat, max_lat, min_lon, max_lon = bbox
+    lats, lons, days = stats['lat'], stats['lon'], stats['day']
+    y0, y1 = int(np.searchsorted(lats, min_lat, 'left')), int(np.searchsorted(lats, max_lat, 'right'))
+    x0, x1 = int(np.searchsorted(lons, min_lon, 'left')), int(np.searchsorted(lons, max_lon, 'right'))
+    d0 = int(np.searchsorted(days, np.datetime64(start_np, 'D'), 'left'))
+    d1 = int(np.searchsorted(days, np.datetime64(end_np, 'D'), 'right'))
+    y1, x1, d1 = max(y0, y1), max(x0, x1), max(d0, d1)
+    days_slice = slice(d0, d1)
+
+    sums = _box(stats['sat_sum'], days_slice, y0, y1, x0, x1)
+    counts = _box(stats['sat_count'], days_slice, y0, y1, x0, x1)
+    period_sum = _box(stats['period_sat_sum'], None, y0, y1, x0, x1)
+    period_count = _box(stats['period_sat_count'], None, y0, y1, x0, x1)
+
+    # Whole tiles inside the bbox, and the cell strips around them
+    t = int(stats['attrs']['tile_cells'])
+    ty0, ty1 = -(-y0 // t), y1 // t
+    tx0, tx1 = -(-x0 // t), x1 // t
+    if ty0 < ty1 and tx0 < tx1:
+        iy0, iy1, ix0, ix1 = ty0 * t, ty1 * t, tx0 * t, tx1 * t
+        inner = (slice(ty0, ty1), slice(tx0, tx1))
+        strips = [
+            (slice(y0, iy0), slice(x0, x1)),
+            (slice(iy1, y1), slice(x0, x1)),
+            (slice(iy0, iy1), slice(x0, ix0)),
+            (slice(iy0, iy1), slice(ix1, x1)),
+        ]
+    else:
+        inner = None
+        strips = [(slice(y0, y1), slice(x0, x1))]
+
+    extremes = {}
+    for name, ufunc, fill in (('min', np.minimum, np.inf), ('max', np.maximum, -np.inf)):
+        parts = [_read(stats[f'daily_{name}'], days_slice, rows, cols) for rows, cols in strips]
+        if inner is not None:
+            parts.append(_read(stats[f'tile_{name}'], days_slice, inner[0], inner[1]))
+        values = _extreme(parts, ufunc, fill)
+        if values is None:
+            values = np.full(d1 - d0, fill)
+        extremes[name] = np.where(np.isinf(values), np.nan, values)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        period_mean = period_sum / period_count if period_count else np.nan
+        overall = sums.sum() / counts.sum() if counts.sum() else np.nan
+
+    def clean(values):
+        values = np.round(np.asarray(values, dtype=np.float64), 3)
+        cells = values.astype(object)
+        cells[np.isnan(values)] = None
+        return cells.tolist()
+
+    return {
+        'days': np.datetime_as_string(days[days_slice], unit='D').tolist(),
+        'mean': clean(means),
+        'min': clean(extremes['min']),
+        'max': clean(extremes['max']),
+        'anomaly': clean(means - period_mean),
+        'count': counts.astype(np.int64).tolist(),
+        'summary': {
+            'mean': clean([overall])[0],
+            'min': clean([np.nanmin(extremes['min'])])[0] if np.isfinite(extremes['min']).any() else None,
+            'max': clean([np.nanmax(extremes['max'])])[0] if np.isfinite(extremes['max']).any() else None,
+            'count': int(counts.sum()),
+            'period_mean': clean([period_mean])[0],
+        },
+    }
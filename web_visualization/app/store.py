@@ -0,0 +1,124 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+# A data store is either a single NetCDF file or a directory of time segments
+# written by ingest. The segments listed in SEGMENTS_FILE make up the store;
+# each is an ordinary NetCDF file with the same variables, covering a later
+# stretch of time than the one before it.
+SEGMENTS_FILE = 'segments.json'
+
+
+def file_version(path):
+    # Cheap identity for a data file: changes whenever the file is rewritten
+    stat = os.stat(path)
+    return f'{int(stat.st_mtime)}-{stat.st_size}'
+
+
+def read_segments(path):
+    # Manifest of a segmented store, or None when the directory has none yet
+    try:
+        with open(os.path.join(path, SEGMENTS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_segments(path, segments):
+    # Replace the manifest atomically; readers see the old list or the new
+    # one, never a mix. Returns the new store version.
+    version = datetime.now(timezone.utc).strftime('s%Y%m%dT%H%M%S%f')
+    staging = os.path.join(path, f'.{SEGMENTS_FILE}.tmp')
+    with open(staging, 'w') as f:
+        json.dump({'version': version, 'segments': segments}, f, indent=2)
+    os.replace(staging, os.path.join(path, SEGMENTS_FILE))
+    return version
+
+
+def store_version(path):
+    if os.path.isdir(path):
+        manifest = read_segments(path)
+        if manifest is None:
+            raise FileNotFoundError(f"No segments in {path}; run ingest first")
+        return manifest['version']
+    return file_version(path)
+
+
+class _TimeConcatArray(BackendArray):
+    # One variable of several segments joined along time (axis 0) without
+    # reading anything: an indexing request is split by segment, each part is
+    # read from its own file and the results are stacked.
+
+    def __init__(self, variables):
+        self.variables = variables
+        self.starts = np.cumsum([0] + [v.shape[0] for v in variables])
+        self.shape = (int(self.starts[-1]),) + variables[0].shape[1:]
+        self.dtype = variables[0].dtype
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(
+            key, self.shape, indexing.IndexingSupport.OUTER, self._getitem)
+
+    def _getitem(self, key):
+        rows, rest = np.arange(self.shape[0])[key[0]], key[1:]
+        if np.ndim(rows) == 0:
+            segment = int(np.searchsorted(self.starts, rows, side='right')) - 1
+            return self._read(segment, rows - self.starts[segment], rest)
+        if len(rows) == 0:
+            return self._read(0, slice(0, 0), rest)
+
+        segments = np.searchsorted(self.starts, rows, side='right') - 1
+        parts = []
+        for run in np.split(np.arange(len(rows)), np.flatnonzero(np.diff(segments)) + 1):
+            segment = segments[run[0]]
+            local = rows[run] - self.starts[segment]
+            # Evenly spaced rows (the usual case) read as a slice
+            step = local[1] - local[0] if len(local) > 1 else 1
+            if step > 0 and np.all(np.diff(local) == step):
+                local = slice(int(local[0]), int(local[-1]) + 1, int(step))
+            parts.append(self._read(segment, local, rest))
+        return np.concatenate(parts, axis=0)
+
+    def _read(self, segment, rows, rest):
+        return np.asarray(self.variables[segment][(rows,) + tuple(rest)].values)
+
+
+def _open_segments(path):
+    manifest = read_segments(path)
+    if manifest is None or not manifest['segments']:
+        raise FileNotFoundError(f"No segments in {path}; run ingest first")
+    parts = [xr.open_dataset(os.path.join(path, name), cache=False) for name in manifest['segments']]
+    if len(parts) == 1:
+        return parts[0]
+
+    first = parts[0]
+    coords = {name: first[name].variable for name in first.coords if 'time' not in first[name].dims}
+    coords['time'] = xr.Variable('time', np.concatenate([p['time'].values for p in parts]),
+                                 first['time'].attrs)
+    data_vars = {}
+    for name, var in first.data_vars.items():
+        if 'time' not in var.dims:
+            data_vars[name] = var.variable
+            continue
+        joined = _TimeConcatArray([p[name].variable for p in parts])
+        data_vars[name] = xr.Variable(var.dims, indexing.LazilyIndexedArray(joined), var.attrs)
+    combined = xr.Dataset(data_vars, coords, first.attrs)
+
+    def close():
+        for part in parts:
+            part.close()
+    combined.set_close(close)
+    return combined
+
+
+def open_store(path):
+    # Lazily open a data store of either layout. Values are decoded only when
+    # indexed; cache=False so reading a window never pins the variable.
+    if os.path.isdir(path):
+        return _open_segments(path)
+    return xr.open_dataset(path, cache=False)
@@ -0,0 +1,221 @@
+import os
+import shutil
+import struct
+import zlib
+
+import numpy as np
+
+from app.backend import in_serving_units
+from app.cache import LRUCache
+
+TILE_SIZE = 256
+MAX_ZOOM = 14
+
+# Tiles rendered on demand are only written to disk up to this zoom; deeper
+# ones live in the memory LRU alone, so requests cannot grow the disk cache
+# without bound. seed() writes whatever it renders.
+DISK_MAX_ZOOM = 8
+
+# Serving variables (see app.backend) that have a colour scale
+TILE_VARIABLES = ('TMP',)
+
+# Same scale as getColor() in static/js/main.js: a value <= COLOR_BREAKS[i]
+# gets COLORS[i], anything above the last break gets the last colour
+COLOR_BREAKS = np.array([0, 5, 10, 15, 20, 25, 30, 35, 40], dtype=np.float32)
+COLORS = ['#313695', '#4575B4', '#74ADD1', '#ABD9E9', '#E0F3F8',
+          '#FFFFBF', '#FEE090', '#FDAE61', '#F46D43', '#A50026']
+TILE_ALPHA = 180
+
+
+def _palette():
+    rgba = np.zeros((len(COLORS) + 1, 4), dtype=np.uint8)
+    for i, color in enumerate(COLORS):
+        rgba[i, :3] = [int(color[k:k + 2], 16) for k in (1, 3, 5)]
+        rgba[i, 3] = TILE_ALPHA
+    # The extra last entry is fully transparent and used for missing data
+    return rgba
+
+
+PALETTE = _palette()
+TRANSPARENT = len(COLORS)
+
+
+def encode_png(rgba):
+    # Minimal 8-bit RGBA PNG writer, enough for map tiles without pulling in an
+    # imaging library
+    height, width, _ = rgba.shape
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', header),
+        chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)),
+        chunk(b'IEND', b''),
+    ])
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def tile_pixel_centers(z, x, y):
+    # Web Mercator is separable: every pixel row shares a latitude and every
+    # column a longitude, so a tile is described by two 1-D vectors
+    n = 2 ** z
+    offsets = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lons = (x + offsets) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + offsets) / n))))
+    return lats, lons
+
+
+def tile_range(z, min_lat, max_lat, min_lon, max_lon):
+    # Inclusive x/y ranges of the tiles at zoom z that cover a bbox
+    n = 2 ** z
+
+    def to_x(lon):
+        return int(np.clip(np.floor((lon + 180.0) / 360.0 * n), 0, n - 1))
+
+    def to_y(lat):
+        lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+        return int(np.clip(np.floor((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n), 0, n - 1))
+
+    return (to_x(min_lon), to_x(max_lon)), (to_y(max_lat), to_y(min_lat))
+
+
+def _nearest_index(coords, targets):
+    # Index of the grid cell containing each target, -1 outside the grid
+    res = coords[1] - coords[0]
+    idx = np.floor((targets - coords[0]) / res + 0.5).astype(np.int64)
+    idx[(idx < 0) | (idx >= len(coords))] = -1
+    return idx
+
+
+def render_tile(field, lats, lons, z, x, y):
+    # Nearest-neighbour resample of a (lat, lon) field onto one tile
+    tile_lats, tile_lons = tile_pixel_centers(z, x, y)
+    rows = _nearest_index(lats, tile_lats)
+    cols = _nearest_index(lons, tile_lons)
+    if (rows < 0).all() or (cols < 0).all():
+        return None
+
+    values = field[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))]
+    classes = np.searchsorted(COLOR_BREAKS, values, side='left')
+    classes[np.isnan(values)] = TRANSPARENT
+    classes[rows < 0, :] = TRANSPARENT
+    classes[:, cols < 0] = TRANSPARENT
+    return encode_png(PALETTE[classes])
+
+
+def time_key(value):
+    return np.datetime_as_string(np.datetime64(value, 's'), unit='s').replace('-', '').replace(':', '')
+
+
+class TileService:
+    # Renders tiles from the dataset and keeps them in a bounded in-memory LRU
+    # in front of an on-disk cache laid out as
+    #   <cache_dir>/<version>/<var>/<time>/<z>/<x>/<y>.png
+    # The version identifies the dataset the tiles were rendered from, so new
+    # data never serves stale tiles; directories of other versions are removed
+    # once a new one is served.
+
+    def __init__(self, cache_dir, max_bytes, field_cache_bytes=64 * 2**20,
+                 disk_max_zoom=DISK_MAX_ZOOM):
+        self.cache_dir = cache_dir
+        self.disk_max_zoom = disk_max_zoom
+        self.version = None
+        self.tiles = LRUCache(max_bytes)
+        self.fields = LRUCache(field_cache_bytes, sizeof=lambda f: f.nbytes)
+
+    def _field(self, data, version, var, time):
+        key = (version, var, time_key(time))
+        field = self.fields.get(key)
+        if field is None:
+            field = np.asarray(in_serving_units(data.sel(time=time)).transpose('lat', 'lon').values,
+                               dtype=np.float32)
+            self.fields.put(key, field)
+        return field
+
+    def _path(self, version, var, time, z, x, y):
+        return os.path.join(self.cache_dir, version, var, time_key(time), str(z), str(x), f'{y}.png')
+
+    def prune(self, version):
+        # Remove the on-disk tiles of every version but this one
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name != version:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def _write(self, path, png):
+        # Another worker may be pruning this version's directory; the tile is
+        # still served from memory if the write loses that race
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def get_tile(self, data, version, var, time, z, x, y, persist=None):
+        # data is the (time, lat, lon) serving variable var of that version.
+        # persist defaults to z <= disk_max_zoom.
+        if version != self.version:
+            self.prune(version)
+            self.version = version
+        if persist is None:
+            persist = z <= self.disk_max_zoom
+
+        key = (version, var, time_key(time), z, x, y)
+        png = self.tiles.get(key)
+        if png is not None:
+            return png
+
+        path = self._path(version, var, time, z, x, y)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                png = f.read()
+        else:
+            field = self._field(data, version, var, time)
+            png = render_tile(field, data['lat'].values, data['lon'].values, z, x, y)
+            if png is None:
+                # Outside the grid: never worth a file or a cache entry
+                return EMPTY_TILE
+            if persist:
+                self._write(path, png)
+
+        self.tiles.put(key, png)
+        return png
+
+    def seed(self, data, version, var, max_zoom, progress=None):
+        # Render every tile covering the dataset extent up to max_zoom, for
+        # every timestep, straight into the disk cache
+        lats, lons = data['lat'].values, data['lon'].values
+        count = 0
+        for time in data['time'].values:
+            for z in range(max_zoom + 1):
+                (x0, x1), (y0, y1) = tile_range(z, lats.min(), lats.max(), lons.min(), lons.max())
+                for x in range(x0, x1 + 1):
+                    for y in range(y0, y1 + 1):
+                        self.get_tile(data, version, var, time, z, x, y, persist=True)
+                        count += 1
+            if progress:
+                progress(time, count)
+        return count
+
+
+def resolve_time(data, value):
+    # Match a URL time segment (e.g. 2024-05-31 or 2024-05-31T00:00:00) to a timestep
+    target = np.datetime64(value)
+    times = data['time'].values
+    matches = np.flatnonzero(times == target)
+    if len(matches) == 0:
+        raise LookupError(f"No data for time {value}")
+    return times[matches[0]]
+
@@ -0,0 +1,217 @@
+# Replay a representative mix of bbox/date queries against the Flask app,
+# served from a synthetic NLDAS-shaped cube, and report p50/p95 latency per
+# query kind and per Server-Timing stage, plus peak memory.
+#
+#   cd web_visualization
+#   python -m benchmarks.bench_api --days 8 --requests 300
+#   python -m benchmarks.bench_api --output bench.json
+#   python -m benchmarks.bench_api --baseline bench.json --tolerance 0.25
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from app import create_app
+from app.backend import publish
+from app.stats import build_stats
+from benchmarks.synthetic import make_nldas_cube
+from config import Config
+
+# kind: (endpoint, bbox size in degrees or None for the whole grid, max days, weight)
+QUERY_KINDS = {
+    'city': ('/api/data', 1.0, 2, 30),
+    'region': ('/api/data', 8.0, 3, 20),
+    'pan': ('/api/data', 8.0, 3, 15),
+    'conus': ('/api/data', None, None, 5),
+    'grid': ('/api/grid', 10.0, 3, 10),
+    'contours': ('/api/contours', 10.0, 1, 10),
+    'stats': ('/api/stats', 10.0, None, 10),
+}
+
+
+def query_mix(n, extent, dates, seed):
+    # Seeded list of (kind, url). 'pan' nudges the previous region window by
+    # less than its size, the way a user drags the map.
+    rng = np.random.default_rng(seed)
+    min_lat, max_lat, min_lon, max_lon = extent
+    kinds = list(QUERY_KINDS)
+    weights = np.array([QUERY_KINDS[k][3] for k in kinds], dtype=float)
+    last_region = None
+    queries = []
+    for kind in rng.choice(kinds, size=n, p=weights / weights.sum()):
+        endpoint, size, max_days, _ = QUERY_KINDS[kind]
+        if size is None:
+            bbox = extent
+        elif kind == 'pan' and last_region is not None:
+            dlat, dlon = rng.uniform(-size / 4, size / 4, 2)
+            lat0 = float(np.clip(last_region[0] + dlat, min_lat, max_lat - size))
+            lon0 = float(np.clip(last_region[2] + dlon, min_lon, max_lon - size))
+            bbox = (lat0, lat0 + size, lon0, lon0 + size)
+        else:
+            lat0 = rng.uniform(min_lat, max(min_lat, max_lat - size))
+            lon0 = rng.uniform(min_lon, max(min_lon, max_lon - size))
+            bbox = (lat0, lat0 + size, lon0, lon0 + size)
+        if kind in ('region', 'pan'):
+            last_region = bbox
+
+        span = len(dates) if max_days is None else int(rng.integers(1, min(max_days, len(dates)) + 1))
+        first = int(rng.integers(0, len(dates) - span + 1))
+        params = {'min_lat': bbox[0], 'max_lat': bbox[1], 'min_lon': bbox[2], 'max_lon': bbox[3]}
+        if kind == 'contours':
+            params['time'] = dates[first]
+        else:
+            params['start_date'] = dates[first]
+            params['end_date'] = dates[first + span - 1]
+        if endpoint == '/api/data':
+            params['format'] = 'binary'
+        query = '&'.join(f'{k}={v:.4f}' if isinstance(v, float) else f'{k}={v}'
+                         for k, v in params.items())
+        queries.append((kind, f'{endpoint}?{query}'))
+    return queries
+
+
+def parse_server_timing(header):
+    timings = {}
+    for entry in header.split(','):
+        name, _, dur = entry.strip().partition(';dur=')
+        if dur:
+            timings[name] = float(dur)
+    return timings
+
+
+def replay(client, queries):
+    # Per kind: latencies (ms), stage timings (ms) and response sizes
+    results = {}
+    for kind, url in queries:
+        started = time.perf_counter()
+        response = client.get(url)
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        entry = results.setdefault(kind, {'latency': [], 'stages': {}, 'bytes': []})
+        entry['latency'].append(elapsed)
+        entry['bytes'].append(len(response.get_data()))
+        for name, ms in parse_server_timing(response.headers.get('Server-Timing', '')).items():
+            if name != 'total':
+                entry['stages'].setdefault(name, []).append(ms)
+    return results
+
+
+def summarize(results):
+    def percentiles(values):
+        return {'p50': float(np.percentile(values, 50)), 'p95': float(np.percentile(values, 95))}
+
+    summary = {}
+    for kind in sorted(results, key=list(QUERY_KINDS).index):
+        entry = results[kind]
+        summary[kind] = dict(percentiles(entry['latency']),
+                             count=len(entry['latency']),
+                             mean_bytes=float(np.mean(entry['bytes'])),
+                             stages={name: percentiles(values) for name, values in entry['stages'].items()})
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    # Kinds whose p95 got slower than the baseline by more than tolerance
+    regressions = []
+    for kind, entry in summary.items():
+        before = baseline.get('kinds', {}).get(kind)
+        if before and entry['p95'] > before['p95'] * (1 + tolerance):
+            regressions.append((kind, before['p95'], entry['p95']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay an API query mix against a synthetic NLDAS cube')
+    parser.add_argument('--days', type=int, default=8)
+    parser.add_argument('--hours-per-day', type=int, default=1)
+    parser.add_argument('--nlat', type=int, default=224)
+    parser.add_argument('--nlon', type=int, default=464)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mapped', action='store_true',
+                        help='publish the cube and serve it from the memory-mapped backend')
+    parser.add_argument('--output', help='write the summary as JSON to this path')
+    parser.add_argument('--baseline', help='JSON summary from an earlier run to compare p95 latency against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative p95 slowdown versus the baseline')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        ds = make_nldas_cube(days=args.days, hours_per_day=args.hours_per_day,
+                             nlat=args.nlat, nlon=args.nlon, seed=args.seed)
+
+        class BenchConfig(Config):
+            DATA_PATH = os.path.join(workdir, 'combined_data.nc')
+            STATS_PATH = os.path.join(workdir, 'stats.nc')
+            BACKEND_DIR = os.path.join(workdir, 'backend')
+            TILE_CACHE_DIR = os.path.join(workdir, 'tiles')
+
+        ds.to_netcdf(BenchConfig.DATA_PATH)
+        if args.mapped:
+            publish(BenchConfig.DATA_PATH, BenchConfig.BACKEND_DIR, log=lambda message: None)
+
+        app = create_app(BenchConfig)
+        client = app.test_client()
+        with app.app_context():
+            from app.routes import get_backend
+            backend = get_backend()
+            build_stats(backend.variables['TMP'], backend.source_version, BenchConfig.STATS_PATH,
+                        log=lambda message: None)
+
+        lats, lons = ds['lat'].values, ds['lon'].values
+        extent = (float(lats[0]), float(lats[-1]), float(lons[0]), float(lons[-1]))
+        dates = sorted(set(np.datetime_as_string(ds['time'].values, unit='D').tolist()))
+        queries = query_mix(args.requests, extent, dates, args.seed)
+
+        print(f"cube {dict(ds['TMP'].sizes)}, {len(queries)} requests, "
+              f"{'mapped' if args.mapped else 'netcdf'} backend")
+        results = replay(client, queries)
+
+        # Second pass from cold caches with allocation tracing on; kept apart
+        # from the timed pass because tracemalloc slows everything down
+        client.post('/api/clear-cache')
+        tracemalloc.start()
+        replay(client, queries)
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Release the open dataset before the temporary directory goes away
+        client.post('/api/clear-cache')
+
+    summary = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'tolerance')},
+        'kinds': summarize(results),
+        'peak_traced_bytes': traced_peak,
+        # ru_maxrss is KiB on Linux and bytes on macOS
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+    }
+
+    print(f"{'kind':<10}{'n':>5}{'p50 (ms)':>10}{'p95 (ms)':>10}{'bytes':>12}  stages p50/p95 (ms)")
+    for kind, entry in summary['kinds'].items():
+        stages = ' '.join(f"{name}={s['p50']:.1f}/{s['p95']:.1f}" for name, s in entry['stages'].items())
+        print(f"{kind:<10}{entry['count']:>5}{entry['p50']:>10.1f}{entry['p95']:>10.1f}"
+              f"{entry['mean_bytes']:>12,.0f}  {stages}")
+    print(f"peak traced {summary['peak_traced_bytes'] / 2**20:.1f} MB, "
+          f"peak RSS {summary['peak_rss_bytes'] / 2**20:.1f} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary['kinds'], json.load(f), args.tolerance)
+        for kind, before, after in regressions:
+            print(f"REGRESSION {kind}: p95 {before:.1f} ms -> {after:.1f} ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
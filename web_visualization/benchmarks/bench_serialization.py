@@ -0,0 +1,96 @@
+# Compare the original DataFrame/row-dict serialization of /api/data with the
+# vectorized encoders in app.serializers. Every path encodes the same cells,
+# picked once by the level-of-detail plan, so only serialization is measured.
+#
+#   cd web_visualization
+#   python -m benchmarks.bench_serialization --days 8 --repeat 3
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+from app.lod import plan_lod
+from app.serializers import encode_binary, encode_columns, encode_rows, extract_points
+from benchmarks.synthetic import make_nldas_cube
+
+
+def legacy_payload(temp_data):
+    # The row-dict path as it was in routes.get_data, minus the random sample
+    df = temp_data.to_dataframe().reset_index()
+    df = df.dropna(subset=['TMP'])
+    df['TMP'] = (df['TMP'] - 273.15).round(2)
+    df['lat'] = df['lat'].round(3)
+    df['lon'] = df['lon'].round(3)
+    result = df.apply(
+        lambda row: {
+            'lat': float(row['lat']),
+            'lon': float(row['lon']),
+            'value': float(row['TMP']),
+            'time': row['time'].isoformat()
+        },
+        axis=1
+    ).tolist()
+    return json.dumps(result).encode()
+
+
+def select_cells(ds, max_points):
+    # The whole record, decimated by the level-of-detail plan as routes.get_data does
+    times = ds['time'].values
+    bbox = (-90.0, 90.0, -180.0, 180.0)
+    indexers, _ = plan_lod(ds, times[0], times[-1], bbox, max_points)
+    return ds['TMP'].sel(height=2.0).isel(indexers).load()
+
+
+def vectorized_payload(temp_data, fmt):
+    columns = extract_points(temp_data - 273.15)
+    if fmt == 'binary':
+        return encode_binary(columns)
+    if fmt == 'columns':
+        return json.dumps(encode_columns(columns)).encode()
+    return json.dumps(encode_rows(columns)).encode()
+
+
+def measure(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    payload = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak, len(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /api/data serialization paths')
+    parser.add_argument('--days', type=int, default=8)
+    parser.add_argument('--hours-per-day', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-points', type=int, default=10000,
+                        help='point budget applied by the LOD stride before encoding (0 disables it)')
+    args = parser.parse_args()
+
+    ds = make_nldas_cube(days=args.days, hours_per_day=args.hours_per_day)
+    max_points = args.max_points or None
+    temp_data = select_cells(ds, max_points)
+    valid = int(np.count_nonzero(~np.isnan(temp_data.values)))
+    print(f"selected {dict(temp_data.sizes)}, {valid} valid cells, cap {max_points}")
+
+    cases = [
+        ('legacy rows', lambda: legacy_payload(temp_data)),
+        ('json rows', lambda: vectorized_payload(temp_data, 'json')),
+        ('json columns', lambda: vectorized_payload(temp_data, 'columns')),
+        ('binary', lambda: vectorized_payload(temp_data, 'binary')),
+    ]
+    print(f"{'path':<14}{'time (ms)':>12}{'peak (MB)':>12}{'bytes':>14}")
+    for name, fn in cases:
+        seconds, peak, size = measure(fn, args.repeat)
+        print(f"{name:<14}{seconds * 1000:>12.1f}{peak / 2**20:>12.1f}{size:>14,}")
+
+
+if __name__ == '__main__':
+    main()
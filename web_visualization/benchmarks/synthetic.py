@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Extent and spacing of the NLDAS 0.125 degree grid
+NLDAS_LAT0 = 25.0625
+NLDAS_LON0 = -124.9375
+NLDAS_RES = 0.125
+NLDAS_NLAT = 224
+NLDAS_NLON = 464
+
+
+def make_nldas_cube(days=8, hours_per_day=1, nlat=NLDAS_NLAT, nlon=NLDAS_NLON,
+                    ocean_fraction=0.3, seed=0):
+    # Build a dataset shaped like combined_data.nc: TMP(time, height, lat, lon)
+    # in Kelvin with a NaN mask standing in for the ocean cells.
+    rng = np.random.default_rng(seed)
+    lat = np.round(NLDAS_LAT0 + NLDAS_RES * np.arange(nlat), 4)
+    lon = np.round(NLDAS_LON0 + NLDAS_RES * np.arange(nlon), 4)
+    time = pd.date_range('2024-05-31', periods=days * hours_per_day,
+                         freq=pd.Timedelta(hours=24 // hours_per_day))
+
+    base = 300.0 - 0.6 * (lat[:, None] - lat.mean()) + 0.02 * (lon[None, :] - lon.mean())
+    diurnal = 4.0 * np.sin(2 * np.pi * time.hour.values / 24.0)
+    tmp = (base[None, :, :] + diurnal[:, None, None]
+           + rng.normal(0.0, 1.5, size=(len(time), nlat, nlon))).astype(np.float32)
+
+    ocean = rng.random((nlat, nlon)) < ocean_fraction
+    tmp[:, ocean] = np.nan
+
+    return xr.Dataset(
+        {'TMP': (('time', 'height', 'lat', 'lon'), tmp[:, None, :, :])},
+        coords={'time': time, 'height': [2.0], 'lat': lat, 'lon': lon},
+    )
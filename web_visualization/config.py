@@ -1,5 +1,15 @@
 import os
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
-    DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'combined_data.nc')
\ No newline at end of file
+    DATA_PATH = os.environ.get('DATA_PATH') or os.path.join(BASE_DIR, 'data', 'store')
+    STATS_PATH = os.environ.get('STATS_PATH') or os.path.join(BASE_DIR, 'data', 'stats.nc')
+    BACKEND_DIR = os.environ.get('BACKEND_DIR') or os.path.join(BASE_DIR, 'data', 'backend')
+    TILE_CACHE_DIR = os.environ.get('TILE_CACHE_DIR') or os.path.join(BASE_DIR, 'data', 'tiles')
+    TILE_CACHE_BYTES = int(os.environ.get('TILE_CACHE_BYTES') or 128 * 2**20)
+    TILE_DISK_MAX_ZOOM = int(os.environ.get('TILE_DISK_MAX_ZOOM') or 8)
+    RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES') or 64 * 2**20)
+    RESPONSE_CACHE_COMPRESS = os.environ.get('RESPONSE_CACHE_COMPRESS', '').lower() in ('1', 'true', 'yes')
+    CONTOUR_CACHE_BYTES = int(os.environ.get('CONTOUR_CACHE_BYTES') or 32 * 2**20)